@@ -0,0 +1,664 @@
+"""
+Benchmarks du générateur de reporting Sunêlia
+──────────────────────────────────────────────
+Mesures ponctuelles, hors CI. Chaque mesure tourne dans un process séparé
+pour que le pic mémoire (RSS) ne soit pas pollué par la mesure précédente.
+
+Usage:
+    python benchmarks.py extract "chemin/vers/*.xlsx" [--repeat 3]
+    python benchmarks.py text ["chemin/vers/*.xlsx"] [--repeat 20]
+    python benchmarks.py gauges [--repeat 30]
+    python benchmarks.py einstein [--calls 200] [--workers 4] [--fail-every 7]
+    python benchmarks.py html ["chemin/vers/Reporting_*.json"] [--repeat 2000]
+    python benchmarks.py startup ["chemin/vers/rapport.xlsx"] [--repeat 5]
+    python benchmarks.py images ["chemin/vers/Reporting_*.json"] [--repeat 3]
+    python benchmarks.py rollup [--campings 500] [--repeat 5]
+"""
+
+import sys, json, argparse, glob, hashlib, subprocess, time, contextlib, io, threading, socket, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_child(*args: str) -> dict:
+    result = subprocess.run([sys.executable, __file__, *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-500:])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# ═══════════════════════════════════════════════════════
+# EXTRACTION EXCEL : openpyxl streaming vs pandas
+# ═══════════════════════════════════════════════════════
+
+def child_extract(engine: str, path: str, repeat: int) -> dict:
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generate_report
+    base = peak_rss_mb()
+
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            text = generate_report.extract_excel(path, engine=engine)
+        best = min(best, time.perf_counter() - t0)
+
+    return {
+        "ms": best * 1000,
+        "base_mb": base,
+        "peak_mb": peak_rss_mb(),
+        "sha": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    }
+
+
+def bench_extract(paths, repeat: int):
+    engines = ("pandas", "openpyxl")
+    print(f"{'Classeur':<48} {'moteur':<9} {'temps ms':>9} {'pic RSS Mo':>11} {'Δ RSS Mo':>9}")
+    mismatches = 0
+    for path in paths:
+        runs = {e: run_child("_extract", e, path, str(repeat)) for e in engines}
+        for e in engines:
+            r = runs[e]
+            print(f"{Path(path).name[-48:]:<48} {e:<9} {r['ms']:>9.1f} {r['peak_mb']:>11.1f} {r['peak_mb'] - r['base_mb']:>9.1f}")
+        if len({r["sha"] for r in runs.values()}) != 1:
+            mismatches += 1
+            print(f"  ⚠ texte différent entre moteurs pour {Path(path).name}")
+    print(f"\n{len(paths)} classeur(s), {mismatches} divergence(s) de texte")
+
+
+# ═══════════════════════════════════════════════════════
+# SHEET_TO_TEXT : version vectorisée vs boucle iterrows d'origine
+# ═══════════════════════════════════════════════════════
+
+def sheet_to_text_legacy(df, max_rows: int = 70) -> str:
+    """Implémentation d'origine (référence golden)."""
+    import pandas as pd
+    lines = []
+    for i, row in df.iterrows():
+        if i >= max_rows:
+            break
+        vals = []
+        for v in row.values:
+            if pd.notna(v):
+                s = str(v).strip()
+                if s and s != "NaN":
+                    if len(s) > 120:
+                        s = s[:120] + "..."
+                    vals.append(s)
+        if vals:
+            lines.append(f"R{i}| {' | '.join(vals)}")
+    return "\n".join(lines)
+
+
+def synthetic_frames(n: int = 40, seed: int = 7) -> list:
+    """DataFrames couvrant les cas piégeux : NaN, float/int, dates, textes longs, espaces, "NaN"."""
+    import random, datetime
+    import pandas as pd
+    rnd = random.Random(seed)
+    pool = [None, float("nan"), "", "  ", "NaN", " txt ", "x" * 150, 0, 7, -3, 2.5, 1e16, 0.1 + 0.2,
+            True, datetime.datetime(2026, 2, 23), datetime.timedelta(hours=2), "2026-02-23", "12:30",
+            "é" * 121, "R0| piège"]
+    frames = []
+    for _ in range(n):
+        rows, cols = rnd.randint(0, 150), rnd.randint(1, 12)
+        kind = rnd.choice(["mixed", "float", "int"])
+        if kind == "float":
+            data = [[rnd.choice([None, rnd.random() * 1e5, 3.0]) for _ in range(cols)] for _ in range(rows)]
+        elif kind == "int":
+            data = [[rnd.randint(-10, 10 ** 6) for _ in range(cols)] for _ in range(rows)]
+        else:
+            data = [[rnd.choice(pool) for _ in range(cols)] for _ in range(rows)]
+        frames.append(pd.DataFrame(data))
+    return frames
+
+
+def bench_text(paths, repeat: int):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generate_report
+        cases = [(f"synthétique #{i}", df, 110) for i, df in enumerate(synthetic_frames())]
+        for path in paths:
+            for engine in ("pandas", "openpyxl"):
+                for target, df in generate_report.load_sheets(path, engine).items():
+                    cases.append((f"{Path(path).name} / {target} ({engine})", df,
+                                  generate_report.SHEETS_CONFIG[target]["max_rows"]))
+
+    diffs = 0
+    for label, df, max_rows in cases:
+        if generate_report.sheet_to_text(df, max_rows) != sheet_to_text_legacy(df, max_rows):
+            diffs += 1
+            print(f"  ⚠ sortie différente : {label}")
+
+    def timed(fn) -> float:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            for _, df, max_rows in cases:
+                fn(df, max_rows)
+        return (time.perf_counter() - t0) / (repeat * len(cases)) * 1e6
+
+    legacy_us = timed(sheet_to_text_legacy)
+    vector_us = timed(generate_report.sheet_to_text)
+    print(f"{len(cases)} feuille(s), {diffs} sortie(s) différente(s) (golden : doit être 0)")
+    print(f"iterrows  : {legacy_us:>9.0f} µs / feuille")
+    print(f"vectorisé : {vector_us:>9.0f} µs / feuille  (x{legacy_us / vector_us:.1f})")
+    if diffs:
+        raise SystemExit(1)
+
+
+# ═══════════════════════════════════════════════════════
+# JAUGES BENCHMARK : gabarit réutilisé vs figure reconstruite
+# ═══════════════════════════════════════════════════════
+
+def _draw_speedometer_legacy(gr, ax, value, label, ring_color, scale_max):
+    """Tracé d'origine d'une jauge (tous les artistes recréés)."""
+    import math
+    from matplotlib.patches import Wedge, FancyBboxPatch, Circle
+    T = gr.THEME
+    v = gr._gauge_value(value)
+    v = max(-scale_max, min(scale_max, v))
+    angle = 90.0 - (v / scale_max) * 90.0 if scale_max > 0 else 90.0
+
+    ax.set_aspect("equal")
+    ax.axis("off")
+    ax.set_xlim(-1.2, 1.2)
+    ax.set_ylim(-0.25, 1.25)
+    ax.add_patch(FancyBboxPatch((-1.15, -0.22), 2.30, 1.45, boxstyle="round,pad=0.02,rounding_size=0.14",
+                                linewidth=0.9, edgecolor=T["border"], facecolor=T["surface"]))
+    ax.add_patch(FancyBboxPatch((-1.05, -0.12), 2.10, 1.25, boxstyle="round,pad=0.02,rounding_size=0.12",
+                                linewidth=0.0, facecolor=T["panel"]))
+    r, width = 0.95, 0.18
+    ax.add_patch(Wedge((0, 0), r, 0, 180, width=width, facecolor="#dfecee", edgecolor="none"))
+    if v != 0:
+        theta1, theta2 = (angle, 90.0) if v >= 0 else (90.0, angle)
+        if abs(theta2 - theta1) > 0.01:
+            ax.add_patch(Wedge((0, 0), r, theta1, theta2, width=width, facecolor=ring_color, edgecolor="none"))
+    ax.text(-r, -0.02, f"-{int(scale_max)}%", ha="left", va="top", fontsize=7.5, color=T["muted2"])
+    ax.text(0,  r+0.02, "0", ha="center", va="bottom", fontsize=8.5, color=T["muted2"], fontweight="bold")
+    ax.text(r,  -0.02, f"+{int(scale_max)}%", ha="right", va="top", fontsize=7.5, color=T["muted2"])
+    ang = math.radians(angle)
+    ax.plot([0, math.cos(ang) * (r - 0.10)], [0, math.sin(ang) * (r - 0.10)],
+            linewidth=2.2, color=T["text"], solid_capstyle="round")
+    ax.add_patch(Circle((0, 0), 0.04, facecolor=T["text"], edgecolor="none"))
+    val_color = T["good"] if v > 0 else T["bad"] if v < 0 else T["muted"]
+    ax.text(0, 0.42, f"{'+' if v > 0 else ''}{v:.1f}%", ha="center", va="center",
+            fontsize=13, fontweight="bold", color=val_color)
+    ax.text(0, 0.17, label, ha="center", va="center", fontsize=8.6, color=T["text"], fontweight="bold")
+    ax.text(0, -0.11, f"Échelle ±{int(scale_max)}%", ha="center", va="center", fontsize=7.2, color=T["muted2"])
+
+
+def plot_speedometers_legacy(gr, title, items, scale_max=None) -> bytes:
+    """plot_benchmark_speedometers d'origine : nouvelle figure à chaque appel (référence golden)."""
+    gr._mpl_setup()
+    plt = gr.plt
+    if scale_max is None:
+        scale_max = gr.nice_scale_max([gr._gauge_value(v) for _, v, _ in items])
+    if scale_max < 1.0:
+        scale_max = 10.0
+    fig = plt.figure(figsize=(9.2, 2.9), dpi=180)
+    fig.patch.set_facecolor("white")
+    fig.suptitle(title, fontsize=11, fontweight="bold", y=0.98, color=gr.THEME["text"])
+    for i, (lbl, val, col) in enumerate(items):
+        _draw_speedometer_legacy(gr, fig.add_subplot(1, len(items), i + 1), val, lbl, col, scale_max)
+    fig.tight_layout(rect=[0, 0, 1, 0.92])
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def gauge_cases(n: int = 12, seed: int = 3) -> list:
+    """Jeux de 3 jauges : valeurs nulles, négatives, hors échelle, NaN, libellés longs."""
+    import random
+    rnd = random.Random(seed)
+    colors = ["#01b4a3", "#00465d", "#028f8c"]
+    labels = ["Les Pins", "Région Occitanie (42)", "Réseau Sunêlia (115)", "Camping au nom vraiment très long"]
+    values = [0, 0.0, -3.2, 12.5, 27.77, -45, 180, float("nan"), None, 0.004]
+    return [(f"Positionnement — cas {k}",
+             [(rnd.choice(labels), rnd.choice(values), colors[i]) for i in range(3)])
+            for k in range(n)]
+
+
+def bench_gauges(repeat: int):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generate_report as gr
+    cases = gauge_cases()
+
+    diffs = sum(gr.plot_benchmark_speedometers(t, items) != plot_speedometers_legacy(gr, t, items)
+                for t, items in cases)
+
+    def timed(fn) -> float:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            for t, items in cases:
+                fn(t, items)
+        return (time.perf_counter() - t0) / (repeat * len(cases)) * 1000
+
+    legacy_ms = timed(lambda t, items: plot_speedometers_legacy(gr, t, items))
+    template_ms = timed(gr.plot_benchmark_speedometers)
+    print(f"{len(cases)} figure(s) de 3 jauges, {diffs} PNG différent(s) (golden : doit être 0)")
+    print(f"figure reconstruite : {legacy_ms:>7.1f} ms / figure")
+    print(f"gabarit réutilisé   : {template_ms:>7.1f} ms / figure  (x{legacy_ms / template_ms:.2f})")
+    if diffs:
+        raise SystemExit(1)
+
+
+# ═══════════════════════════════════════════════════════
+# HTML DU MAIL : µs par rapport
+# ═══════════════════════════════════════════════════════
+
+def html_cases(n: int = 40, seed: int = 11) -> list:
+    """Rapports synthétiques : sections absentes, valeurs nulles ou texte,
+    caractères HTML, nombres d'insights impairs, saisons hautes."""
+    import random
+    rnd = random.Random(seed)
+    nums = [None, 0, 0.0, -12.345, 7, 1234567.891, "n/a", "12", -0.04]
+
+    def kpi():
+        return {"n": rnd.choice(nums), "n1": rnd.choice(nums), "var_pct": rnd.choice(nums), "delta_pts": rnd.choice(nums)}
+
+    cases = []
+    for k in range(n):
+        D = {
+            "meta": {"camping_name": rnd.choice(["Camping <Les Pins> & Spa", "L'Étoile \"Mer\"", "X"]),
+                     "date_observation": rnd.choice(["23/02/2026", "", "2026"]),
+                     "date_comparaison": rnd.choice(["23/02/2025", "x"])},
+            "kpi_fermes": {key: kpi() for key in ("ca", "sejours", "nuits", "prix_moyen_nuit", "taux_occupation", "revpar")},
+            "kpi_total": {"ca": kpi(), "sejours": kpi(), "stock": rnd.choice([412, "-", "<b>", None])},
+            "produits": {"total_ca": rnd.choice([0, 452311.5, None]),
+                         "location": {"ca": rnd.choice([0, 312000.25]), "var_pct": rnd.choice([0, -3.5, 12])},
+                         "emplacement": {"ca": rnd.choice([0, 140311]), "var_pct": rnd.choice([None, 4.2, -1])}},
+            "saisonnalite": [{"periode": rnd.choice(["Juillet", "Août <haute>", "Ponts & WE"]), "ca_n": rnd.choice(nums[:6]),
+                              "ca_n1": rnd.choice(nums[:6]), "var_pct": rnd.choice([None, 0, -5.5, 18.2]),
+                              "sejours": rnd.choice(nums[:6]), "taux_occ": rnd.choice(nums[:6]), "is_haute": rnd.random() < .3}
+                             for _ in range(rnd.randint(0, 9))] + ["pas un dict"],
+            "bassins": [{"region": rnd.choice(["Île-de-France", "Hauts-de-France", "<script>"]), "ca": rnd.choice(nums[:6]),
+                         "pct_total": rnd.choice(nums[:6]), "var_pct": rnd.choice([None, 0, -2.1, 9])}
+                        for _ in range(rnd.randint(0, 10))],
+            "insights": [{"type": rnd.choice(["positive", "warning", "alert", "info", "autre"]),
+                          "title": f"Titre {i} & <co>", "text": "Texte \"cité\" " * rnd.randint(1, 20)}
+                         for i in range(rnd.randint(0, 7))],
+        }
+        if k % 7 == 3:
+            del D["bassins"], D["produits"]
+        cases.append(D)
+    return cases
+
+
+def bench_html(paths, repeat: int):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generate_report as gr
+    cases = html_cases() + [json.loads(Path(p).read_text(encoding="utf-8")) for p in paths]
+    cids = {key: f"{key}@sunelia" for key in ("bm_ca", "bm_sj", "mc", "wk", "donut")}
+
+    rounds = max(1, repeat // len(cases))
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for D in cases:
+            gr.build_email_html(D, cids)
+    us = (time.perf_counter() - t0) / (rounds * len(cases)) * 1e6
+    print(f"{len(cases)} rapport(s) ({len(paths)} réel(s)) : {us:.1f} µs / rapport")
+
+
+# ═══════════════════════════════════════════════════════
+# EINSTEIN : session poolée vs requests.post
+# ═══════════════════════════════════════════════════════
+
+EINSTEIN_PATH = "/services/apexrest/einstein/generate"
+
+
+def einstein_stub():
+    """Serveur local qui imite Einstein (HTTP/1.1 keep-alive, réponse ~8 Ko).
+
+    stats["fail_every"] = N : une requête sur N échoue, alternativement en 503
+    (Retry-After: 0) et en connexion coupée sans réponse.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    stats = {"requests": 0, "connections": set(), "fail_every": 0}
+    lock = threading.Lock()
+    body = json.dumps({"text": json.dumps({"insights": [{"type": "info", "title": "t" * 40, "text": "x" * 1200}] * 6})}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            # en-têtes et corps partent en deux write() : sans TCP_NODELAY, Nagle +
+            # ACK retardé ajoutent ~40 ms par réponse sur une connexion réutilisée
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                stats["requests"] += 1
+                stats["connections"].add(self.client_address)
+                n, every = stats["requests"], stats["fail_every"]
+            if self.path != EINSTEIN_PATH:
+                self.send_error(404)
+                return
+            if every and n % every == 0:
+                if (n // every) % 2:
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                else:
+                    self.close_connection = True
+                    self.connection.close()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json;charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def bench_einstein(calls: int, workers: int, fail_every: int):
+    import requests
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generate_report as gr
+    server, stats = einstein_stub()
+    url = f"http://127.0.0.1:{server.server_port}"
+    prompts = [f"prompt {i} " + "données " * 400 for i in range(calls)]
+
+    def legacy(prompt):
+        resp = requests.post(url + EINSTEIN_PATH, json={"prompt": prompt, "model": gr.EINSTEIN_MODEL},
+                             headers={"Authorization": "Bearer x"}, timeout=30)
+        resp.raise_for_status()
+        return resp.text
+
+    def measure(fn, fail=0):
+        stats.update(requests=0, connections=set(), fail_every=fail)
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(workers) as pool:
+            outs = list(pool.map(fn, prompts))
+        ms = (time.perf_counter() - t0) / calls * 1000
+        return ms, len(stats["connections"]), stats["requests"], outs
+
+    client = gr.EinsteinClient(pool_size=workers)
+    pooled = lambda prompt: gr.call_einstein(prompt, "x", url, client=client)
+    legacy_ms, legacy_conn, _, ref = measure(legacy)
+    pooled_ms, pooled_conn, _, outs = measure(pooled)
+    faulty_ms, faulty_conn, faulty_req, faulty_outs = measure(pooled, fail_every)
+    client.close()
+    server.shutdown()
+
+    diffs = sum(a != b for a, b in zip(ref, outs)) + sum(a != b for a, b in zip(ref, faulty_outs))
+    print(f"{calls} appel(s), {workers} en parallèle, {diffs} réponse(s) différente(s) (doit être 0)")
+    print(f"requests.post        : {legacy_ms:>6.2f} ms / appel, {legacy_conn:>4} connexion(s) TCP")
+    print(f"EinsteinClient       : {pooled_ms:>6.2f} ms / appel, {pooled_conn:>4} connexion(s) TCP  (x{legacy_ms / pooled_ms:.2f})")
+    if fail_every:
+        print(f"  + panne 1/{fail_every:<8}: {faulty_ms:>6.2f} ms / appel, {faulty_conn:>4} connexion(s), "
+              f"{faulty_req - calls} reprise(s), 0 échec")
+    if diffs:
+        raise SystemExit(1)
+
+
+# ═══════════════════════════════════════════════════════
+# ROLLUP GROUPE : agrégation vectorisée vs boucles Python
+# ═══════════════════════════════════════════════════════
+
+def rollup_cases(n: int = 500, seed: int = 5) -> list:
+    """Run synthétique de n campings au format Reporting_<nom>.json (tailles, variations et saisons variées)."""
+    import random
+    rnd = random.Random(seed)
+    regions = ["Bretagne", "Occitanie", "PACA", "Grand Est", "Normandie", "Île-de-France", "Hauts-de-France"]
+    periodes = ["Basse saison 1", "Moyenne saison", "Haute saison 1", "Très haute saison", "Haute saison 2", "Basse saison 2"]
+
+    def kpi(n1, var):
+        return {"n": round(n1 * (1 + var / 100), 2), "n1": n1, "var_pct": var}
+
+    cases = []
+    for i in range(n):
+        size = rnd.uniform(0.2, 4.0)
+        ca, nuits = kpi(round(350000 * size), round(rnd.uniform(-30, 45), 2)), kpi(round(5000 * size), round(rnd.uniform(-20, 30), 2))
+        taux_n, taux_n1 = rnd.uniform(15, 80), rnd.uniform(15, 80)
+        dispo_n, dispo_n1 = nuits["n"] / taux_n * 100, nuits["n1"] / taux_n1 * 100
+        cases.append({
+            "meta": {"camping_name": f"Camping Sunêlia C{i}", "date_observation": "23/02/2026", "date_comparaison": "24/02/2025"},
+            "kpi_fermes": {
+                "ca": ca, "sejours": kpi(round(800 * size), round(rnd.uniform(-20, 30), 2)), "nuits": nuits,
+                "prix_moyen_nuit": {"n": ca["n"] / nuits["n"], "n1": ca["n1"] / nuits["n1"], "var_pct": 0},
+                "taux_occupation": {"n": taux_n, "n1": taux_n1, "delta_pts": taux_n - taux_n1},
+                "revpar": {"n": ca["n"] / dispo_n, "n1": ca["n1"] / dispo_n1, "var_pct": 0},
+            },
+            "kpi_total": {"ca": {"n": ca["n"] * 1.05, "var_pct": ca["var_pct"]}, "sejours": {"n": round(850 * size), "var_pct": 5},
+                          "stock": round(300 * size)},
+            "benchmark": {"ca": {"camping": ca["var_pct"], "region": 12.0, "reseau": 9.0},
+                          "sejours": {"camping": 3.0, "region": -3.0, "reseau": 4.5},
+                          "region_label": "Région", "region_nb": 42, "reseau_label": "Réseau Sunêlia", "reseau_nb": 115},
+            "montee_charge": [{"date": f"{d:02d}/08", "n": 10000 * d * size, "n1": 9000 * d * size} for d in range(1, 26)],
+            "ventes_semaine": [{"sem": f"S{w:02d}", "n": rnd.uniform(0, 30000) * size, "n1": rnd.uniform(0, 30000) * size}
+                               for w in range(1, 21)],
+            "produits": {"location": {"ca": ca["n"] * 0.75, "var_pct": 20, "sejours_n": 500, "pmn": 98.0},
+                         "emplacement": {"ca": ca["n"] * 0.25, "var_pct": 5, "sejours_n": 300, "pmn": 35.0},
+                         "total_ca": ca["n"]},
+            "saisonnalite": [{"periode": p, "ca_n": rnd.uniform(0, 90000) * size, "ca_n1": rnd.uniform(1, 90000) * size,
+                              "var_pct": 0, "sejours": rnd.randint(50, 200), "taux_occ": rnd.uniform(10, 90), "is_haute": "Haute" in p}
+                             for p in periodes],
+            "bassins": [{"region": r, "ca": rnd.uniform(5000, 50000) * size, "pct_total": 0, "var_pct": rnd.uniform(-20, 40)}
+                        for r in rnd.sample(regions, 5)],
+            "insights": [],
+        })
+    return cases
+
+
+def rollup_reference(reports: list) -> dict:
+    """Totaux du groupe recalculés par boucles Python (référence golden)."""
+    ca_n = sum(D["kpi_fermes"]["ca"]["n"] for D in reports)
+    ca_n1 = sum(D["kpi_fermes"]["ca"]["n1"] for D in reports)
+    dispo = sum(D["kpi_fermes"]["nuits"]["n"] / D["kpi_fermes"]["taux_occupation"]["n"] * 100 for D in reports)
+    nuits = sum(D["kpi_fermes"]["nuits"]["n"] for D in reports)
+    mc, bassins = {}, {}
+    for D in reports:
+        for row in D["montee_charge"]:
+            mc[row["date"]] = mc.get(row["date"], 0) + row["n"]
+        for row in D["bassins"]:
+            bassins[row["region"]] = bassins.get(row["region"], 0) + row["ca"]
+    return {"ca": round(ca_n, 2), "ca_var": round((ca_n / ca_n1 - 1) * 100, 2), "to": round(nuits / dispo * 100, 2),
+            "revpar": round(ca_n / dispo, 2), "mc": {d: round(v, 2) for d, v in mc.items()},
+            "bassins": {r: round(v) for r, v in bassins.items()}}
+
+
+def bench_rollup(campings: int, repeat: int):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generate_report as gr
+    reports = rollup_cases(campings)
+    gr.group_report_data(html_cases())   # données incomplètes ou invalides : ne doit pas lever
+
+    ref = rollup_reference(reports)
+    D = gr.group_report_data(reports)
+    got = {"ca": D["kpi_fermes"]["ca"]["n"], "ca_var": D["kpi_fermes"]["ca"]["var_pct"],
+           "to": D["kpi_fermes"]["taux_occupation"]["n"], "revpar": D["kpi_fermes"]["revpar"]["n"],
+           "mc": {row["date"]: row["n"] for row in D["montee_charge"]},
+           "bassins": {row["region"]: row["ca"] for row in D["bassins"]}}
+    diffs = [key for key in ref if ref[key] != got[key]]
+
+    # dossier de run sans registre : seuls les Reporting_<nom>.json sont des rapports
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, D in enumerate(reports[:20]):
+            (Path(tmp) / f"Reporting_C{n:02d}.json").write_text(json.dumps(D), encoding="utf-8")
+            (Path(tmp) / f"Reporting_C{n:02d}.timings.json").write_text(json.dumps({"extract": {}}), encoding="utf-8")
+        (Path(tmp) / f"{gr.ROLLUP_PREFIX}_2026_01_01.json").write_text(json.dumps(reports[0]), encoding="utf-8")
+        if gr.load_run_reports(tmp) != reports[:20]:
+            diffs.append("load_run_reports (sans registre)")
+
+    def timed(fn) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        return best * 1000
+
+    frame_ms = timed(lambda: gr.rollup_frame(reports))
+    total_ms = timed(lambda: gr.group_report_data(reports))
+    print(f"{campings} camping(s), {len(diffs)} total(aux) différent(s) de la référence (golden : doit être 0)"
+          + (f" : {', '.join(diffs)}" if diffs else ""))
+    print(f"table du run (rollup_frame) : {frame_ms:>7.1f} ms")
+    print(f"rapport groupe complet      : {total_ms:>7.1f} ms  (objectif < 1000 ms)")
+    if diffs or total_ms >= 1000:
+        raise SystemExit(1)
+
+
+# ═══════════════════════════════════════════════════════
+# IMAGES DU MAIL : profils retina / standard / light
+# ═══════════════════════════════════════════════════════
+
+def bench_images(paths, repeat: int):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generate_report as gr
+    cases = [json.loads(Path(p).read_text(encoding="utf-8")) for p in paths] or html_cases(3)
+    gr.render_charts(cases[0])  # chauffe : polices, gabarits de jauges
+    print(f"{len(cases)} rapport(s), rendu dans le process courant, meilleur de {repeat}")
+    for profile in gr.IMAGE_PROFILES:
+        best, sizes = float("inf"), []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            sizes = [{} for _ in cases]
+            for D, size in zip(cases, sizes):
+                gr.build_report_eml(D, "a@b.c", "d@e.f", "x", image_profile=profile, sizes=size)
+            best = min(best, (time.perf_counter() - t0) / len(cases) * 1000)
+        total = sum(r["total"] for r in sizes) / len(sizes) / 1024
+        images = sum(r["images"] for r in sizes) / len(sizes) / 1024
+        print(f"{profile:<9}: {total:>6.0f} Ko / mail (images {images:>5.0f} Ko en base64), {best:>6.0f} ms / mail")
+
+
+# ═══════════════════════════════════════════════════════
+# DÉMARRAGE CLI : -X importtime
+# ═══════════════════════════════════════════════════════
+
+HEAVY_MODULES = ("numpy", "pandas", "matplotlib", "requests", "openpyxl")
+
+
+def import_times(args: list, repeat: int) -> tuple:
+    """Lance generate_report.py : (meilleur temps mur en ms, {module racine: ms cumulées}, paquets importés).
+
+    Le temps mur est pris sans -X importtime (qui ralentit chaque import) ; un
+    lancement supplémentaire sous -X importtime donne le détail par module.
+    """
+    walls = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True)
+        walls.append((time.perf_counter() - t0) * 1000)
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output=True, text=True)
+    modules, packages = {}, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        packages.add(name.strip().split(".")[0])
+        if not name.startswith("  "):  # import de premier niveau
+            modules[name.strip()] = int(cumulative) / 1000
+    return min(walls), modules, packages
+
+
+def bench_startup(path: str, repeat: int):
+    script = str(Path(__file__).with_name("generate_report.py"))
+    out_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    # (libellé, arguments, modules lourds attendus)
+    cases = [
+        ("interpréteur seul", ["-c", "pass"], set()),
+        ("--help", [script, "--help"], set()),
+        ("fichier introuvable", [script, str(Path(out_dir) / "absent.xlsx")], set()),
+    ]
+    if path:
+        cases.append(("--dry-run", [script, path, "--dry-run", "--output", out_dir], {"numpy", "pandas", "openpyxl"}))
+
+    failures = 0
+    base_ms = None
+    for label, args, expected in cases:
+        wall_ms, modules, packages = import_times(args, repeat)
+        base_ms = wall_ms if base_ms is None else base_ms
+        loaded = packages & set(HEAVY_MODULES)
+        top = sorted(((ms, m) for m, ms in modules.items() if m != "site"), reverse=True)[:3]
+        print(f"{label:<20}: {wall_ms:>7.1f} ms  (+{wall_ms - base_ms:>6.1f} ms / interpréteur), "
+              f"lourds : {', '.join(sorted(loaded)) or 'aucun'}")
+        print(f"{'':<22}" + ", ".join(f"{m} {ms:.0f} ms" for ms, m in top))
+        if loaded - expected:
+            print(f"  ❌ importé(s) sans besoin : {', '.join(sorted(loaded - expected))}")
+            failures += 1
+    if failures:
+        raise SystemExit(1)
+
+
+# ═══════════════════════════════════════════════════════
+# MAIN
+# ═══════════════════════════════════════════════════════
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "_extract":
+        print(json.dumps(child_extract(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmarks du générateur de reporting Sunêlia")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("extract", help="Extraction Excel : temps et pic RSS par classeur et par moteur")
+    p.add_argument("paths", nargs="+", help="Fichiers .xlsx (motifs glob acceptés)")
+    p.add_argument("--repeat", type=int, default=3, help="Répétitions par mesure, meilleur temps retenu")
+    p = sub.add_parser("text", help="sheet_to_text : sortie golden identique à iterrows + µs par feuille")
+    p.add_argument("paths", nargs="*", help="Fichiers .xlsx en plus des cas synthétiques (motifs glob acceptés)")
+    p.add_argument("--repeat", type=int, default=20, help="Répétitions pour le chronométrage")
+    p = sub.add_parser("gauges", help="Jauges benchmark : PNG golden identique + ms par figure")
+    p.add_argument("--repeat", type=int, default=30, help="Répétitions pour le chronométrage")
+    p = sub.add_parser("html", help="HTML du mail : µs par rapport")
+    p.add_argument("paths", nargs="*", help="Reporting_<nom>.json réels en plus des cas synthétiques (motifs glob acceptés)")
+    p.add_argument("--repeat", type=int, default=2000, help="Nombre de rendus chronométrés")
+    p = sub.add_parser("einstein", help="Appels Einstein sur serveur local : session poolée vs requests.post")
+    p.add_argument("--calls", type=int, default=200, help="Nombre d'appels")
+    p.add_argument("--workers", type=int, default=4, help="Appels simultanés")
+    p.add_argument("--fail-every", type=int, default=7, help="Une requête sur N en échec (503 / connexion coupée), 0 = aucune")
+    p = sub.add_parser("startup", help="Démarrage de generate_report.py : ms et modules lourds importés par chemin CLI")
+    p.add_argument("path", nargs="?", default="", help="Classeur .xlsx pour mesurer aussi --dry-run")
+    p.add_argument("--repeat", type=int, default=5, help="Lancements par chemin, meilleur temps retenu")
+    p = sub.add_parser("images", help="Profils d'image du mail : Ko par mail et ms de rendu par profil")
+    p.add_argument("paths", nargs="*", help="Reporting_<nom>.json réels (motifs glob acceptés ; défaut : cas synthétiques)")
+    p.add_argument("--repeat", type=int, default=3, help="Répétitions, meilleur temps retenu")
+    p = sub.add_parser("rollup", help="Rollup groupe : totaux golden identiques aux boucles Python + ms pour N campings")
+    p.add_argument("--campings", type=int, default=500, help="Nombre de rapports camping agrégés")
+    p.add_argument("--repeat", type=int, default=5, help="Répétitions, meilleur temps retenu")
+    args = parser.parse_args()
+
+    if args.cmd == "extract":
+        paths = sorted({f for pattern in args.paths for f in glob.glob(pattern)})
+        if not paths:
+            raise SystemExit("Aucun fichier .xlsx trouvé")
+        bench_extract(paths, args.repeat)
+    elif args.cmd == "text":
+        bench_text(sorted({f for pattern in args.paths for f in glob.glob(pattern)}), args.repeat)
+    elif args.cmd == "gauges":
+        bench_gauges(args.repeat)
+    elif args.cmd == "html":
+        bench_html(sorted({f for pattern in args.paths for f in glob.glob(pattern)}), args.repeat)
+    elif args.cmd == "einstein":
+        bench_einstein(args.calls, args.workers, args.fail_every)
+    elif args.cmd == "rollup":
+        bench_rollup(args.campings, args.repeat)
+    elif args.cmd == "images":
+        bench_images(sorted({f for pattern in args.paths for f in glob.glob(pattern)}), args.repeat)
+    elif args.cmd == "startup":
+        bench_startup(args.path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,62 @@
-﻿from playwright.sync_api import sync_playwright
+﻿import asyncio
 import os
+import re
+import sys
 import json
+import subprocess
+from html.parser import HTMLParser
+from urllib.parse import unquote, urljoin, urlparse
+
+from playwright.async_api import async_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeout
 
 LOGIN = os.environ["CRM_LOGIN"]
 PASSWORD = os.environ["CRM_PASSWORD"]
 DOWNLOAD_DIR = os.path.abspath("./downloads")
 HISTORY_FILE = os.path.join(DOWNLOAD_DIR, "downloaded_files.json")
-CRM_URL = "https://crm.secureholiday.net/crm/"
-REPORTS_URL = "https://crm.secureholiday.net/crm/Dashboards/BiReportExtract/Index/FR"
+# Cookies de la derniere session CRM (storage_state Playwright), rejoues au run suivant
+STATE_FILE = os.path.join(DOWNLOAD_DIR, "crm_state.json")
+CRM_URL = os.environ.get("CRM_URL", "https://crm.secureholiday.net/crm/")
+REPORTS_URL = os.environ.get(
+    "CRM_REPORTS_URL", "https://crm.secureholiday.net/crm/Dashboards/BiReportExtract/Index/FR"
+)
+# Nombre de telechargements HTTP simultanes (requetes via la session du navigateur)
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "4"))
+# auto : HTTP pur avec la session enregistree, navigateur si elle a expire
+# http : HTTP pur uniquement ; browser : toujours le navigateur
+CRM_MODE = os.environ.get("CRM_MODE", "auto")
+
+LOGIN_MARKER = "Entrez votre login"
+LOGIN_INPUT = f'input[placeholder="{LOGIN_MARKER}"]'
+PASSWORD_INPUT = 'input[placeholder="Mot de passe"]'
+DOWNLOAD_SELECTOR = (
+    "a[href*='Download'], a[href*='download'], button.download, "
+    ".fa-download, a.btn-download, td a[title], a.glyphicon"
+)
+FALLBACK_SELECTOR = "table tbody tr td:last-child a, table tbody tr td:last-child button"
+
+# Nom de fichier plausible dans une cellule, un title ou une URL
+FILE_EXTENSIONS = (".zip", ".xlsx", ".xls", ".csv")
+FILE_NAME_RE = re.compile(r"[^\s/\\:*?\"<>|]+\.(?:zip|xlsx|xls|csv)\b", re.I)
+
+# Pour chaque element : href absolu du lien englobant (null si le telechargement
+# passe par du JavaScript : bouton, href="#", javascript:...) et les textes de la
+# ligne du tableau qui peuvent porter le nom du fichier
+LINK_INFO_JS = """els => els.map(e => {
+    const a = e.closest('a');
+    let href = null;
+    if (a) {
+        const raw = a.getAttribute('href') || '';
+        if (raw && raw !== '#' && !raw.startsWith('javascript:')) href = a.href;
+    }
+    const row = e.closest('tr');
+    const texts = [
+        a && a.getAttribute('download'),
+        (a || e).getAttribute('title'),
+        e.getAttribute('data-filename'),
+        ...(row ? Array.from(row.cells, c => c.innerText) : []),
+    ];
+    return {href, texts: texts.filter(Boolean)};
+})"""
 
 def load_history():
     if os.path.exists(HISTORY_FILE):
@@ -19,60 +68,326 @@ def save_history(history):
     with open(HISTORY_FILE, "w") as f:
         json.dump(list(history), f)
 
-def main():
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-    history = load_history()
+def filename_from_headers(headers, url):
+    """Nom du fichier d'apres Content-Disposition, sinon d'apres l'URL."""
+    cd = headers.get("content-disposition", "")
+    m = re.search(r"filename\*\s*=\s*[\w-]+'[^']*'([^;]+)", cd, re.I)
+    if m:
+        name = unquote(m.group(1).strip())
+    else:
+        m = re.search(r'filename\s*=\s*"([^"]+)"|filename\s*=\s*([^;]+)', cd, re.I)
+        name = (m.group(1) or m.group(2)).strip() if m else unquote(urlparse(url).path)
+    return os.path.basename(name.replace("\\", "/"))
+
+def name_hint(texts, href=None):
+    """Nom de fichier annonce par la ligne du tableau (attribut download, title,
+    cellules) ou par l'URL, sans rien telecharger. None si rien d'exploitable."""
+    for text in texts:
+        m = FILE_NAME_RE.search(text)
+        if m:
+            return m.group(0)
+    if href:
+        name = os.path.basename(unquote(urlparse(href).path))
+        if os.path.splitext(name)[1].lower() in FILE_EXTENSIONS:
+            return name
+    return None
+
+class ReportTableParser(HTMLParser):
+    """Lecture sans navigateur de la page des rapports : pour chaque lien, son
+    href, ses attributs et les textes de sa ligne, comme LINK_INFO_JS."""
+
+    def __init__(self):
+        super().__init__()
+        self.anchors = []   # dicts : href, attrs, row, cell, icon
+        self.buttons = 0    # boutons sans href (telechargement en JS)
+        self.rows = []      # textes des cellules, par ligne
+        self._row = self._cell = self._anchor = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: v or "" for k, v in attrs}
+        if tag == "tr":
+            self._row = len(self.rows)
+            self.rows.append([])
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = len(self.rows[self._row])
+            self.rows[self._row].append("")
+        elif tag == "a":
+            self._anchor = {"href": attrs.get("href", ""), "attrs": attrs,
+                            "row": self._row, "cell": self._cell, "icon": False}
+            self.anchors.append(self._anchor)
+        elif tag == "button" and self._cell is not None:
+            self.buttons += 1
+        if self._anchor is not None and "fa-download" in attrs.get("class", "").split():
+            self._anchor["icon"] = True
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._anchor = None
+        elif tag in ("td", "th"):
+            self._cell = None
+        elif tag == "tr":
+            self._row = self._cell = None
+
+    def handle_data(self, data):
+        if self._row is not None and self._cell is not None:
+            self.rows[self._row][self._cell] += data
+
+    def is_download(self, a):
+        classes = a["attrs"].get("class", "").split()
+        return ("download" in a["href"].lower() or a["icon"]
+                or "btn-download" in classes or "glyphicon" in classes
+                or (a["cell"] is not None and "title" in a["attrs"]))
+
+    def is_last_cell(self, a):
+        return a["row"] is not None and a["cell"] == len(self.rows[a["row"]]) - 1
+
+def links_from_html(html, base_url):
+    """Equivalent HTTP de collect_links : (liens, nb de boutons JS) trouves dans
+    le HTML de la page des rapports."""
+    parser = ReportTableParser()
+    parser.feed(html)
+    anchors = [a for a in parser.anchors if parser.is_download(a)]
+    if not anchors:
+        anchors = [a for a in parser.anchors if parser.is_last_cell(a)]
+
+    links, seen = [], set()
+    for a in anchors:
+        raw = a["href"]
+        if not raw or raw == "#" or raw.startswith("javascript:"):
+            parser.buttons += 1
+            continue
+        href = urljoin(base_url, raw)
+        if href in seen:
+            continue
+        seen.add(href)
+        attrs = a["attrs"]
+        texts = [attrs.get("download"), attrs.get("title"), attrs.get("data-filename")]
+        if a["row"] is not None:
+            texts += parser.rows[a["row"]]
+        links.append((href, name_hint([t for t in texts if t], href)))
+    return links, parser.buttons
+
+def is_login_page(url, html):
+    return LOGIN_MARKER in html or urlparse(url).path.rstrip("/") == urlparse(CRM_URL).path.rstrip("/")
+
+def save_file(filename, data):
+    """Ecriture atomique : un fichier interrompu ne passe jamais pour complet."""
+    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    tmp = filepath + ".part"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, filepath)
+    return filepath
+
+async def login(page):
+    await page.goto(CRM_URL, wait_until="domcontentloaded", timeout=60000)
+    await page.wait_for_selector(LOGIN_INPUT, timeout=30000)
+    await page.fill(LOGIN_INPUT, LOGIN)
+    await page.fill(PASSWORD_INPUT, PASSWORD)
+    await page.click("text=SE CONNECTER")
+    await page.wait_for_load_state("networkidle", timeout=30000)
+    await page.context.storage_state(path=STATE_FILE)
+    print(f"Connecte : {page.url}")
+
+async def open_reports(page):
+    """Ouvre la page des rapports. False si le CRM renvoie vers le login
+    (session enregistree expiree ou absente)."""
+    await page.goto(REPORTS_URL, wait_until="domcontentloaded", timeout=60000)
+    try:
+        await page.wait_for_selector(f"{DOWNLOAD_SELECTOR}, {FALLBACK_SELECTOR}, {LOGIN_INPUT}",
+                                     state="attached", timeout=30000)
+    except PlaywrightTimeout:
+        return True
+    return await page.query_selector(LOGIN_INPUT) is None
+
+async def collect_links(page):
+    """Retourne (liens, boutons) : les couples (url, nom annonce) a telecharger en
+    HTTP et les couples (element, nom annonce) sans URL exploitable, a cliquer."""
+    elements = await page.query_selector_all(DOWNLOAD_SELECTOR)
+    if not elements:
+        elements = await page.query_selector_all(FALLBACK_SELECTOR)
+
+    links, buttons, seen = [], [], set()
+    infos = await page.evaluate(LINK_INFO_JS, elements)
+    for el, info in zip(elements, infos):
+        href, hint = info["href"], name_hint(info["texts"], info["href"])
+        if href is None:
+            buttons.append((el, hint))
+        elif href not in seen:
+            seen.add(href)
+            links.append((href, hint))
+    return links, buttons
+
+async def probe_filename(request, url):
+    """HEAD sur l'URL : nom du fichier d'apres Content-Disposition, sans le corps.
+    None si le serveur ne repond pas au HEAD ou n'annonce pas de nom."""
+    try:
+        resp = await request.head(url, timeout=30000)
+    except Exception:
+        return None
+    try:
+        if resp.ok and "content-disposition" in resp.headers:
+            return filename_from_headers(resp.headers, url)
+        return None
+    finally:
+        await resp.dispose()
+
+async def fetch_all(request, links, history, workers=DOWNLOAD_WORKERS):
+    """Telecharge les liens (url, nom annonce) en parallele (au plus `workers` a la
+    fois) via un APIRequestContext authentifie. Les fichiers deja connus sont
+    ecartes avant tout GET, d'apres le nom annonce ou a defaut un HEAD.
+    Retourne la liste des nouveaux fichiers."""
+    sem = asyncio.Semaphore(max(1, workers))
     new_files = []
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(accept_downloads=True)
-        page = context.new_page()
-
-        page.goto(CRM_URL, wait_until="domcontentloaded", timeout=60000)
-        page.wait_for_timeout(3000)
-        page.fill('input[placeholder="Entrez votre login"]', LOGIN)
-        page.fill('input[placeholder="Mot de passe"]', PASSWORD)
-        page.click('text=SE CONNECTER')
-        page.wait_for_load_state("networkidle", timeout=30000)
-        print(f"Connecte : {page.url}")
-
-        page.goto(REPORTS_URL, wait_until="domcontentloaded", timeout=60000)
-        page.wait_for_timeout(5000)
-
-        download_buttons = page.query_selector_all(
-            "a[href*='Download'], a[href*='download'], button.download, "
-            ".fa-download, a.btn-download, td a[title], a.glyphicon"
-        )
-        if not download_buttons:
-            download_buttons = page.query_selector_all(
-                "table tbody tr td:last-child a, table tbody tr td:last-child button"
-            )
-
-        print(f"Trouve {len(download_buttons)} fichiers")
-
-        for i, btn in enumerate(download_buttons):
+    async def fetch(i, url, hint):
+        filename = None
+        async with sem:
+            if hint is None:
+                hint = await probe_filename(request, url)
+            if hint in history:
+                print(f"Deja telecharge : {hint}")
+                return
             try:
-                with page.expect_download(timeout=30000) as download_info:
-                    btn.click()
-                download = download_info.value
-                filename = download.suggested_filename
-
-                if filename not in history:
-                    filepath = os.path.join(DOWNLOAD_DIR, filename)
-                    download.save_as(filepath)
-                    new_files.append(filepath)
+                resp = await request.get(url, timeout=60000)
+                try:
+                    if not resp.ok:
+                        raise RuntimeError(f"HTTP {resp.status} sur {url}")
+                    if resp.headers.get("content-type", "").startswith("text/html"):
+                        # redirection vers la page de login : session expiree
+                        raise RuntimeError(f"page HTML au lieu d'un fichier sur {url}")
+                    filename = filename_from_headers(resp.headers, url)
+                    if filename in history:
+                        print(f"Deja telecharge : {filename}")
+                        return
                     history.add(filename)
-                    print(f"Nouveau : {filename}")
-                else:
-                    print(f"Deja telecharge : {filename}")
+                    if hint and hint != filename:
+                        # le nom affiche differe du nom servi : on retient les deux pour
+                        # ecarter ce fichier des le prochain passage
+                        history.add(hint)
+                    body = await resp.body()
+                finally:
+                    # corps libere dans tous les cas, y compris sur erreur HTTP ou page HTML
+                    await resp.dispose()
             except Exception as e:
+                history.discard(filename)
+                history.discard(hint)
                 print(f"Erreur {i}: {e}")
+                return
+        try:
+            new_files.append(save_file(filename, body))
+            print(f"Nouveau : {filename}")
+        except OSError as e:
+            history.discard(filename)
+            history.discard(hint)
+            print(f"Erreur {i}: {e}")
+
+    await asyncio.gather(*(fetch(i, url, hint) for i, (url, hint) in enumerate(links)))
+    return new_files
+
+async def click_downloads(page, buttons, history, offset=0):
+    """Repli sequentiel pour les boutons qui declenchent le telechargement en JS."""
+    new_files = []
+    for i, (btn, hint) in enumerate(buttons, offset):
+        if hint in history:
+            print(f"Deja telecharge : {hint}")
+            continue
+        try:
+            async with page.expect_download(timeout=30000) as download_info:
+                await btn.click()
+            download = await download_info.value
+            filename = download.suggested_filename
+
+            if filename not in history:
+                filepath = os.path.join(DOWNLOAD_DIR, filename)
+                await download.save_as(filepath)
+                new_files.append(filepath)
+                history.add(filename)
+                if hint:
+                    history.add(hint)
+                print(f"Nouveau : {filename}")
+            else:
+                print(f"Deja telecharge : {filename}")
+        except Exception as e:
+            print(f"Erreur {i}: {e}")
+    return new_files
+
+async def run_http(p, history):
+    """Mode sans navigateur : rejoue les cookies de STATE_FILE avec un
+    APIRequestContext (connexions reutilisees). Retourne None si la session a
+    expire ou si la page exige le navigateur (boutons JS, tableau vide)."""
+    if not os.path.exists(STATE_FILE):
+        return None
+    request = await p.request.new_context(storage_state=STATE_FILE)
+    try:
+        resp = await request.get(REPORTS_URL, timeout=60000)
+        html = await resp.text()
+        if resp.status in (401, 403) or not resp.ok or is_login_page(resp.url, html):
+            print(f"Session enregistree expiree (HTTP {resp.status}), connexion via le navigateur")
+            return None
+        links, buttons = links_from_html(html, resp.url)
+        if buttons or not links:
+            print(f"Page non exploitable sans navigateur ({len(links)} liens, {buttons} boutons JS)")
+            return None
+        print(f"Session reprise sans navigateur : {len(links)} fichiers")
+        new_files = await fetch_all(request, links, history)
+        await request.storage_state(path=STATE_FILE)
+        return new_files
+    finally:
+        await request.dispose()
 
-        browser.close()
+async def launch_browser(p):
+    """Lance Chromium ; l'installe a la volee s'il manque (la CI ne l'installe
+    plus d'office, le mode HTTP suffisant la plupart du temps)."""
+    try:
+        return await p.chromium.launch(headless=True)
+    except PlaywrightError as e:
+        if "Executable doesn't exist" not in str(e):
+            raise
+    print("Chromium absent, installation...")
+    subprocess.run([sys.executable, "-m", "playwright", "install", "--with-deps", "chromium"], check=True)
+    return await p.chromium.launch(headless=True)
+
+async def run_browser(p, history):
+    browser = await launch_browser(p)
+    state = STATE_FILE if os.path.exists(STATE_FILE) else None
+    context = await browser.new_context(accept_downloads=True, storage_state=state)
+    page = await context.new_page()
+
+    if not await open_reports(page):
+        await login(page)
+        await open_reports(page)
+    links, buttons = await collect_links(page)
+    print(f"Trouve {len(links) + len(buttons)} fichiers "
+          f"({len(links)} liens directs, {len(buttons)} boutons)")
+
+    # context.request partage les cookies de la session connectee
+    new_files = await fetch_all(context.request, links, history)
+    new_files += await click_downloads(page, buttons, history, offset=len(links))
+
+    await context.storage_state(path=STATE_FILE)
+    await browser.close()
+    return new_files
+
+async def run():
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    history = load_history()
+
+    async with async_playwright() as p:
+        new_files = None
+        if CRM_MODE != "browser":
+            new_files = await run_http(p, history)
+        if new_files is None:
+            if CRM_MODE == "http":
+                raise SystemExit("Session CRM invalide et CRM_MODE=http : pas de repli navigateur")
+            new_files = await run_browser(p, history)
 
     save_history(history)
     print(f"\nTermine : {len(new_files)} nouveau(x) fichier(s)")
+    return new_files
+
+def main():
+    return asyncio.run(run())
 
 if __name__ == "__main__":
     main()
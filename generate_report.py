@@ -11,48 +11,90 @@ Usage:
     python generate_report.py "chemin/vers/rapport.xlsx"
     python generate_report.py "chemin/vers/rapport.xlsx" --org PROD --output "C:/Reports"
     python generate_report.py "chemin/vers/rapport.xlsx" --dry-run
+    python generate_report.py --batch "chemin/vers/dossier" --output "C:/Reports"
+    python generate_report.py --batch "chemin/vers/archive.zip"   (xlsx lus dans le zip, sans extraction)
+    python generate_report.py "chemin/vers/rapport.xlsx" --refresh   (ignore le cache IA)
+    python generate_report.py "chemin/vers/rapport.xlsx" --no-rules  (tout le JSON par l'IA)
+    python generate_report.py "chemin/vers/rapport.xlsx" --prompt-stats  (tokens par feuille, sans API)
+    python generate_report.py "chemin/vers/rapport.xlsx" --profile  (cProfile du rendu des graphiques)
+    python generate_report.py --batch "chemin/vers/archive.zip" --rollup   (+ mail groupe du batch)
+    python generate_report.py --rollup "chemin/vers/dossier_du_run"       (mail groupe seul, sans IA)
 
 Options email:
     --from "reporting@sunelia.com"
     --to "destinataire@exemple.com"
     --subject "Reporting Sunêlia - ..."
+    --image-profile standard   (retina | standard | light : dpi et palette des PNG)
+    --max-mail-kb 400          (au-delà, pièces jointes non comprises, profils d'image plus légers)
 """
 
-import sys, json, subprocess, argparse, re, time, shutil, math
+from __future__ import annotations
+
+import sys, os, json, subprocess, argparse, re, time, shutil, math, random, threading, hashlib, tempfile, unicodedata
+import contextlib, cProfile, importlib.util, marshal, zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from datetime import datetime, timedelta
 from io import BytesIO
 from html import escape as hesc
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Callable, TYPE_CHECKING
 
 try:
-    import pandas as pd
-except ImportError:
-    print("❌ pandas requis. Installe-le : pip install pandas openpyxl")
-    sys.exit(1)
+    import resource
+except ImportError:  # Windows : pas de pic mémoire dans les timings
+    resource = None
 
-try:
-    import requests
-except ImportError:
-    print("❌ requests requis. Installe-le : pip install requests")
-    sys.exit(1)
+if TYPE_CHECKING:  # annotations seulement : le pool de process n'est importé qu'à sa création
+    from concurrent.futures import ProcessPoolExecutor
 
-try:
-    import matplotlib
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-    from matplotlib.ticker import FuncFormatter
-    from matplotlib.patches import Wedge, FancyBboxPatch, Circle
-except ImportError:
-    print("❌ matplotlib requis pour générer les graphiques email. Installe-le : pip install matplotlib")
-    sys.exit(1)
-
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email import policy
 import math
 
 
+# numpy / pandas / requests / matplotlib coûtent ~1,2 s d'import à eux quatre :
+# ils ne sont chargés qu'au premier usage. --help et les erreurs d'arguments
+# répondent immédiatement, --dry-run ne charge ni matplotlib ni requests.
+class _LazyModule:
+    """Module lourd importé au premier accès à l'un de ses attributs.
+
+    Au chargement, le proxy se remplace dans les globals du module par le vrai
+    module : les accès suivants ne passent plus par lui.
+    """
+
+    def __init__(self, alias: str, name: str, hint: str, agg: bool = False):
+        self._alias, self._name, self._hint, self._agg = alias, name, hint, agg
+
+    def _load(self):
+        try:
+            if self._agg:
+                import matplotlib
+                matplotlib.use("Agg")
+            module = importlib.import_module(self._name)
+        except ImportError as e:
+            raise ImportError(f"❌ {self._hint}") from e
+        globals()[self._alias] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+np = _LazyModule("np", "numpy", "pandas requis. Installe-le : pip install pandas openpyxl")
+pd = _LazyModule("pd", "pandas", "pandas requis. Installe-le : pip install pandas openpyxl")
+requests = _LazyModule("requests", "requests", "requests requis. Installe-le : pip install requests")
+_MPL_HINT = "matplotlib requis pour générer les graphiques email. Installe-le : pip install matplotlib"
+plt = _LazyModule("plt", "matplotlib.pyplot", _MPL_HINT, agg=True)
+mticker = _LazyModule("mticker", "matplotlib.ticker", _MPL_HINT, agg=True)
+mpatches = _LazyModule("mpatches", "matplotlib.patches", _MPL_HINT, agg=True)
+
+
+def check_dependencies(*modules) -> None:
+    """Arrête le script si un module paresseux n'est pas installé (find_spec : rien n'est importé)."""
+    for module in modules:
+        if isinstance(module, _LazyModule) and importlib.util.find_spec(module._name.split(".")[0]) is None:
+            print(f"❌ {module._hint}")
+            sys.exit(1)
+
+
 # ═══════════════════════════════════════════════════════
 # THEME (Sunêlia-inspired teal / lagon)
 # ═══════════════════════════════════════════════════════
@@ -89,14 +131,19 @@ THEME = {
 # 1. EXTRACTION EXCEL
 # ═══════════════════════════════════════════════════════
 
+# max_rows   : lignes lues par feuille
+# max_tokens : budget de la feuille dans le prompt (encodage compact)
+# drop       : lignes dont le libellé n'est lu par aucune règle du schéma
+# formats    : relève les cellules au format pourcentage (df.attrs["pct_cells"]),
+#              seule indication d'échelle des VAR d'une feuille sans colonne N-1
 SHEETS_CONFIG = {
-    "Vue synthétique":        {"max_rows": 60},
-    "Suivi activite globale": {"max_rows": 70},
-    "Ventes produit":         {"max_rows": 50},
-    "Ventes sem.":            {"max_rows": 110},
-    "Montée en charge":       {"max_rows": 40},
-    "Bassins emetteurs":      {"max_rows": 110},
-    "Couverture":             {"max_rows": 10},
+    "Vue synthétique":        {"max_rows": 60,  "max_tokens": 2500, "drop": r"^produits residentiels$"},
+    "Suivi activite globale": {"max_rows": 70,  "max_tokens": 1800},
+    "Ventes produit":         {"max_rows": 50,  "max_tokens": 1000, "formats": True},
+    "Ventes sem.":            {"max_rows": 110, "max_tokens": 2200},
+    "Montée en charge":       {"max_rows": 40,  "max_tokens": 900},
+    "Bassins emetteurs":      {"max_rows": 110, "max_tokens": 1500, "formats": True},
+    "Couverture":             {"max_rows": 10,  "max_tokens": 200},
 }
 
 
@@ -113,40 +160,831 @@ def find_sheet(available: List[str], target: str) -> Optional[str]:
 
 
 def sheet_to_text(df: pd.DataFrame, max_rows: int = 70) -> str:
-    lines = []
-    for i, row in df.iterrows():
-        if i >= max_rows:
-            break
-        vals = []
-        for v in row.values:
-            if pd.notna(v):
-                s = str(v).strip()
-                if s and s != "NaN":
-                    if len(s) > 120:
-                        s = s[:120] + "..."
-                    vals.append(s)
-        if vals:
-            lines.append(f"R{i}| {' | '.join(vals)}")
-    return "\n".join(lines)
-
-
-def extract_excel(filepath: str) -> str:
-    xls = pd.ExcelFile(filepath)
-    available = xls.sheet_names
-    blocks = []
+    """Texte "R{i}| v1 | v2 ..." des max_rows premières lignes (cellules vides ignorées).
+
+    Traitement colonne par colonne sur le tableau numpy : seul l'assemblage
+    final des lignes reste une boucle Python. Le texte est identique octet
+    pour octet à l'ancienne boucle df.iterrows().
+    """
+    head = df.iloc[:max_rows]
+    if head.empty:
+        return ""
+
+    values = head.values   # même conversion de dtypes que df.iterrows()
+    keep = pd.notna(values)
+    cells = np.char.strip(values.astype(str))
+
+    if values.dtype == object:
+        # iterrows ré-infère chaque ligne : une ligne 100 % dates (ou durées)
+        # devient datetime64 et s'affiche "2026-02-23T00:00:00.000000".
+        # Pré-filtre sur la forme du texte ("AAAA-MM-JJ..." ou "...:..."), puis
+        # vérification exacte des types sur les seules lignes candidates.
+        chars = cells.astype("<U8", order="C").view(np.uint32).reshape(cells.shape + (8,))
+        dt_like = (chars[..., 4] == ord("-")) & (chars[..., 7] == ord("-"))
+        td_like = np.char.find(cells, ":") >= 0
+        candidates = (dt_like | td_like | ~keep).all(axis=1) & keep.any(axis=1)
+        for r in np.flatnonzero(candidates):
+            present = values[r][keep[r]]
+            if all(isinstance(v, datetime) for v in present) or all(isinstance(v, timedelta) for v in present):
+                row = [str(v).strip() for v in pd.Series(values[r], index=head.columns).values]
+                width = max(map(len, row))
+                if width > cells.itemsize // 4:
+                    cells = cells.astype(f"<U{width}")
+                cells[r] = row
+
+    keep &= (cells != "") & (cells != "NaN")
+
+    long = np.char.str_len(cells) > 120
+    if long.any():
+        cells = np.where(long, np.char.add(cells.astype("<U120"), "..."), cells)
+
+    return "\n".join(
+        f"R{i}| {' | '.join(row[mask])}"
+        for i, row, mask in zip(head.index, cells, keep)
+        if mask.any()
+    )
+
 
+EXTRACT_ENGINES = ("openpyxl", "pandas")
+
+# Textes que pd.read_excel lit comme NaN (na_values par défaut) + codes d'erreur Excel
+_PD_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    "#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#GETTING_DATA",
+})
+
+
+_NUM_STR = re.compile(r"^\s*[-+]?((\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?|inf(inity)?)\s*$", re.IGNORECASE)
+_INT_STR = re.compile(r"^\s*[-+]?\d+\s*$")
+
+
+def _to_number(v):
+    if isinstance(v, str):
+        return int(v) if _INT_STR.match(v) else float(v)
+    return int(v) if isinstance(v, bool) else v
+
+
+def _read_sheet_streaming(ws, max_rows: int, formats: bool = False) -> pd.DataFrame:
+    """Lit une feuille openpyxl (read-only) comme pd.read_excel(header=None), limitée à max_rows lignes.
+
+    Les lignes au-delà de max_rows ne sont pas conservées : elles sont seulement
+    parcourues pour reproduire l'inférence de type par colonne de pandas (une
+    colonne numérique avec un vide ou un décimal passe en float, 12 → "12.0"),
+    afin que sheet_to_text produise exactement le même texte.
+    Avec formats=True, les cellules conservées au format pourcentage (0.0%)
+    sont relevées dans df.attrs["pct_cells"] = {(ligne, colonne)}.
+    """
+    kept = []
+    pct_cells = set()
+    numeric, all_bool, has_float, has_na = [], [], [], []
+    min_len = None      # largeur min. des lignes jusqu'à la dernière ligne non vide (padding pandas)
+    empty_run = False
+    last_data = -1
+
+    ws.reset_dimensions()
+    for i, raw in enumerate(ws.iter_rows(values_only=not formats)):
+        if formats:
+            if i < max_rows:
+                pct_cells.update((i, j) for j, cell in enumerate(raw)
+                                 if cell.value is not None and _is_pct_format(cell.number_format))
+            raw = [cell.value for cell in raw]
+        row = list(raw)
+        while row and (row[-1] is None or row[-1] == ""):
+            row.pop()
+        if not row:
+            empty_run = True
+            if i < max_rows:
+                kept.append(row)
+            continue
+
+        last_data = i
+        min_len = 0 if empty_run else len(row) if min_len is None else min(min_len, len(row))
+        empty_run = False
+        if len(row) > len(numeric):
+            grow = len(row) - len(numeric)
+            numeric += [True] * grow
+            all_bool += [True] * grow
+            has_float += [False] * grow
+            has_na += [False] * grow
+
+        for j, v in enumerate(row):
+            if v is None or (isinstance(v, str) and v in _PD_NA_STRINGS):
+                has_na[j] = True
+                row[j] = None
+                continue
+            if isinstance(v, bool):
+                continue
+            all_bool[j] = False
+            if isinstance(v, float):
+                if v.is_integer():
+                    row[j] = int(v)
+                else:
+                    has_float[j] = True
+            elif isinstance(v, str) and _NUM_STR.match(v):
+                if not _INT_STR.match(v):
+                    has_float[j] = True
+            elif not isinstance(v, int):
+                numeric[j] = False
+        if i < max_rows:
+            kept.append(row)
+
+    kept = kept[:last_data + 1]
+    width = len(numeric)
+    if not kept or not width:
+        return pd.DataFrame()
+
+    # Type final de chaque colonne, comme TextParser : "object", "bool", "int" ou "float"
+    kinds = []
+    for j in range(width):
+        na = has_na[j] or j >= min_len
+        if not numeric[j]:
+            kinds.append("object")
+        elif all_bool[j]:
+            kinds.append("float" if na else "bool")
+        else:
+            kinds.append("float" if na or has_float[j] else "int")
+    if all(k in ("int", "float") for k in kinds) and "float" in kinds:
+        kinds = ["float"] * width   # DataFrame 100 % numérique : iterrows promeut tout en float
+
+    memos = [{} for _ in range(width)]   # pandas interne les valeurs égales (1 == True) par colonne
+    data = []
+    for row in kept:
+        row = row + [None] * (width - len(row))
+        out = []
+        for j, v in enumerate(row):
+            if v is not None:
+                kind = kinds[j]
+                if kind == "object":
+                    v = memos[j].setdefault(v, v)
+                elif kind == "int":
+                    v = _to_number(v)
+                elif kind == "float":
+                    v = float(_to_number(v))
+            out.append(v)
+        data.append(out)
+    df = pd.DataFrame(data, dtype=object)
+    if formats:
+        df.attrs["pct_cells"] = frozenset(pct_cells)
+    return df
+
+
+def _is_pct_format(number_format: Optional[str]) -> bool:
+    """Format Excel pourcentage (valeur stockée en fraction) ; un % littéral entre guillemets n'en est pas un."""
+    return "%" in re.sub(r'"[^"]*"|\\.', "", number_format or "")
+
+
+def load_sheets(filepath, engine: str = "openpyxl") -> dict:
+    """Charge les feuilles de SHEETS_CONFIG : {nom cible: DataFrame}, nom réel dans df.attrs["sheet"].
+
+    filepath : chemin du classeur ou flux binaire (BytesIO d'un membre de zip).
+
+    engine="openpyxl" : classeur ouvert une seule fois en streaming read-only,
+                        max_rows lignes conservées par feuille.
+    engine="pandas"   : pd.read_excel complet par feuille (chemin historique), sans
+                        formats de cellule (ventes produit et bassins repassent par le LLM).
+    """
+    if engine not in EXTRACT_ENGINES:
+        raise ValueError(f"Moteur d'extraction inconnu: {engine}")
+
+    frames = {}
+    if engine == "pandas":
+        xls = pd.ExcelFile(filepath)
+        for target_name in SHEETS_CONFIG:
+            sheet = find_sheet(xls.sheet_names, target_name)
+            if sheet:
+                print(f"        → Feuille: {sheet}")
+                frames[target_name] = pd.read_excel(xls, sheet_name=sheet, header=None)
+                frames[target_name].attrs["sheet"] = sheet
+        return frames
+
+    from openpyxl import load_workbook
+    wb = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        for target_name, cfg in SHEETS_CONFIG.items():
+            sheet = find_sheet(wb.sheetnames, target_name)
+            if sheet:
+                print(f"        → Feuille: {sheet}")
+                frames[target_name] = _read_sheet_streaming(wb[sheet], cfg["max_rows"], cfg.get("formats", False))
+                frames[target_name].attrs["sheet"] = sheet
+    finally:
+        wb.close()
+    return frames
+
+
+def zip_workbooks(zip_path) -> List[zipfile.Path]:
+    """Classeurs .xlsx d'une archive, triés par nom, sans extraction sur disque.
+
+    Chaque zipfile.Path s'utilise comme un Path (name, stem, read_bytes) ;
+    generate_one le lit une fois en mémoire.
+    """
+    with zipfile.ZipFile(zip_path) as z:
+        members = sorted(
+            n for n in z.namelist()
+            if n.lower().endswith(".xlsx") and not n.startswith("__MACOSX/")
+            and not Path(n).name.startswith("~$")
+        )
+    return [zipfile.Path(zip_path, at=n) for n in members]
+
+
+def source_dir(excel_path) -> Path:
+    """Dossier du classeur, ou de l'archive pour un membre de zip."""
+    if isinstance(excel_path, zipfile.Path):
+        return Path(excel_path.root.filename).parent
+    return Path(excel_path).parent
+
+
+def sheets_to_text(frames: dict) -> str:
+    blocks = []
     for target_name, cfg in SHEETS_CONFIG.items():
-        sheet = find_sheet(available, target_name)
-        if not sheet:
+        if target_name not in frames:
             continue
-        print(f"        → Feuille: {sheet}")
-        df = pd.read_excel(xls, sheet_name=sheet, header=None)
+        df = frames[target_name]
+        sheet = df.attrs["sheet"]
         text = sheet_to_text(df, cfg["max_rows"])
         blocks.append(f"{'='*40}\nFEUILLE: {sheet}\n{'='*40}\n{text}\n")
 
     return "\n".join(blocks)
 
 
+def extract_excel(filepath: str, engine: str = "openpyxl") -> str:
+    return sheets_to_text(load_sheets(filepath, engine))
+
+
+# ── Encodage compact pour le prompt
+# Colonnes alignées séparées par "|" (vides conservées entre deux valeurs),
+# colonnes entièrement vides supprimées, en-têtes répétés dédoublonnés,
+# nombres sous forme canonique (0.27770001 → 0.2777, 354000.0 → 354000).
+
+_TOKEN_RX = re.compile(r"\d{1,3}|[^\W\d_]+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation du nombre de tokens (mots, groupes de 3 chiffres, ponctuation)."""
+    return len(_TOKEN_RX.findall(text))
+
+
+def _canon(v) -> str:
+    if v is None or isinstance(v, (bool, np.bool_)):
+        return "" if v is None else str(bool(v))
+    if isinstance(v, (int, np.integer)):
+        return str(int(v))
+    if isinstance(v, (float, np.floating)):
+        if math.isnan(v) or math.isinf(v):
+            return ""
+        if v.is_integer() and abs(v) < 1e15:
+            return str(int(v))
+        return f"{v:.4g}" if abs(v) < 1 else str(round(v, 2))
+    if isinstance(v, datetime):
+        return v.strftime("%d/%m/%Y" if (v.hour, v.minute, v.second) == (0, 0, 0) else "%d/%m/%Y %H:%M")
+    if hasattr(v, "strftime"):   # date, time
+        return v.strftime("%H:%M" if hasattr(v, "hour") else "%d/%m/%Y")
+    s = re.sub(r"\s+", " ", str(v)).strip()
+    if s == "NaN":
+        return ""
+    return s[:120] + "..." if len(s) > 120 else s
+
+
+def compact_sheet_text(df: pd.DataFrame, cfg: dict) -> Tuple[str, int]:
+    """Texte compact "R{i}|v1|v2||v4" d'une feuille, borné à cfg["max_tokens"].
+
+    Retourne (texte, lignes coupées par le budget).
+    """
+    rows = df.iloc[:cfg["max_rows"]].values.tolist()
+    cells = [[_canon(v) for v in row] for row in rows]
+    used = [any(row[c] for row in cells) for c in range(len(cells[0]))] if cells else []
+    drop = re.compile(cfg["drop"]) if cfg.get("drop") else None
+
+    lines, seen_headers, budget, cut = [], set(), cfg.get("max_tokens"), 0
+    tokens = 0
+    for i, row in enumerate(cells):
+        vals = [v for v, u in zip(row, used) if u]
+        while vals and not vals[-1]:
+            vals.pop()
+        if not vals:
+            continue
+        label = next((v for v in vals if v), "")
+        if drop and drop.search(_norm(label)):
+            continue
+        if all(_num(v) is None for v in vals if v):
+            key = tuple(vals)
+            if key in seen_headers:
+                continue
+            seen_headers.add(key)
+        line = f"R{i}|" + "|".join(vals)
+        n = estimate_tokens(line)
+        if budget and tokens + n > budget:
+            cut = sum(1 for row in cells[i:] if any(row))
+            lines.append(f"(… {cut} ligne(s) coupée(s) : budget {budget} tokens)")
+            break
+        tokens += n
+        lines.append(line)
+    return "\n".join(lines), cut
+
+
+def sheets_to_prompt_text(frames: dict) -> str:
+    """Équivalent compact de sheets_to_text, utilisé dans build_prompt."""
+    blocks = []
+    for target_name, cfg in SHEETS_CONFIG.items():
+        if target_name in frames:
+            text, _ = compact_sheet_text(frames[target_name], cfg)
+            blocks.append(f"## FEUILLE: {frames[target_name].attrs['sheet']}\n{text}")
+    return "\n".join(blocks)
+
+
+def prompt_stats(frames: dict) -> List[dict]:
+    """Tokens par feuille : texte historique (sheet_to_text) vs encodage compact."""
+    stats = []
+    for target_name, cfg in SHEETS_CONFIG.items():
+        if target_name not in frames:
+            continue
+        df = frames[target_name]
+        before = sheet_to_text(df, cfg["max_rows"])
+        after, cut = compact_sheet_text(df, cfg)
+        stats.append({
+            "sheet": df.attrs["sheet"],
+            "tokens_before": estimate_tokens(before),
+            "tokens_after": estimate_tokens(after),
+            "budget": cfg.get("max_tokens"),
+            "rows_cut": cut,
+        })
+    return stats
+
+
+def print_prompt_stats(frames: dict):
+    stats = prompt_stats(frames)
+    print(f"        {'Feuille':<26} {'avant':>7} {'après':>7} {'budget':>7}  coupé")
+    for st in stats:
+        print(f"        {st['sheet'][:26]:<26} {st['tokens_before']:>7} {st['tokens_after']:>7} "
+              f"{st['budget'] or '-':>7}  {st['rows_cut'] or ''}")
+    full_before = estimate_tokens(build_prompt(sheets_to_text(frames), compact=False))
+    full_after = estimate_tokens(build_prompt(sheets_to_prompt_text(frames)))
+    print(f"        {'Prompt complet':<26} {full_before:>7} {full_after:>7}   "
+          f"(-{100 - full_after * 100 // max(1, full_before)}%)")
+
+
+# ──────────────────────────────────────────────────────
+# Extraction déterministe des indicateurs chiffrés (sans LLM)
+# ──────────────────────────────────────────────────────
+# Chaque section de JSON_SCHEMA est relue directement dans les DataFrames de
+# load_sheets, aux emplacements décrits dans les règles du prompt. Une section
+# n'est acceptée que si ses contrôles de cohérence passent (ex: var_pct
+# recalculé depuis n / n1) ; sinon elle est déclarée manquante et le rapport
+# repasse par le prompt complet.
+
+SAISON_PERIODES = [
+    "Basse saison 1", "Moyenne saison", "Haute saison 1", "Très haute saison",
+    "Haute saison 2", "Dernière semaine août", "Basse saison 2",
+]
+
+# Indicateurs de "Vue synthétique", testés dans cet ordre sur l'en-tête de colonne
+KPI_METRICS = [
+    ("revpar",          r"revpar"),
+    ("prix_moyen_nuit", r"prix moyen|\bpmn\b"),
+    ("taux_occupation", r"taux d.?occ|\bto\b"),
+    ("sejours",         r"sejour"),
+    ("nuits",           r"\bnuit"),
+    ("ca",              r"\bca\b|chiffre d.?affaires"),
+]
+
+# Colonnes des tableaux ligne à ligne : premier motif qui correspond à l'en-tête
+SAISON_COLUMNS = [("ca_n1", r"n ?- ?1"), ("var_pct", r"var|evol|%"), ("sejours", r"sejour"),
+                  ("taux_occ", r"taux|occ|\bto\b"), ("ca_n", r"\bca\b|chiffre")]
+PRODUIT_COLUMNS = [("var_pct", r"var|evol|%"), ("sejours_n", r"sejour"), ("pmn", r"prix moyen|pmn"),
+                   ("ca", r"\bca\b|chiffre")]
+BASSIN_COLUMNS = [("pct_total", r"part|total|poids"), ("var_pct", r"var|evol|%"), ("ca", r"\bca\b|chiffre|montant")]
+
+REGIONS_FR = [
+    "auvergne", "bourgogne", "bretagne", "centre", "corse", "grand est", "hauts-de-france", "hauts de france",
+    "ile-de-france", "ile de france", "normandie", "nouvelle-aquitaine", "nouvelle aquitaine", "occitanie",
+    "pays de la loire", "provence", "paca", "outre-mer", "dom",
+]
+
+_DATE_LABEL = re.compile(r"^(\d{1,2})/(\d{1,2})(/\d{2,4})?$")
+_WEEK_LABEL = re.compile(r"\d{1,2}/\d{1,2}\s*(-|au)\s*\d{1,2}/\d{1,2}")
+
+
+def _norm(v) -> str:
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return ""
+    s = unicodedata.normalize("NFKD", str(v)).encode("ascii", "ignore").decode()
+    return re.sub(r"\s+", " ", s).strip().lower()
+
+
+def _num(v) -> Optional[float]:
+    if v is None or isinstance(v, (bool, datetime, timedelta)):
+        return None
+    if isinstance(v, (int, float, np.integer, np.floating)):
+        f = float(v)
+        return None if math.isnan(f) or math.isinf(f) else f
+    s = re.sub(r"[\s €%]", "", str(v)).replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _var_fits(n, n1, var, scale: int) -> bool:
+    expected = (n / n1 - 1) * 100
+    return abs(var * scale - expected) <= max(0.15, abs(expected) * 0.02)
+
+
+def _pct_scale(g: "_Grid", triples=(), cells=()) -> Optional[int]:
+    """Échelle des pourcentages d'une feuille : 100 si fractions Excel (0.412), 1 si déjà en % (41.2).
+
+    D'abord par recoupement des VAR avec n / n1 (triples (n, n1, var)), sinon
+    d'après le format des cellules `cells` ((ligne, colonne)) : toutes au
+    format pourcentage → 100. None si indéterminable ou contradictoire.
+    """
+    scales = set()
+    for n, n1, var in triples:
+        if None in (n, n1, var) or n1 == 0:
+            continue
+        fits = [scale for scale in (100, 1) if _var_fits(n, n1, var, scale)]
+        if len(fits) == 1:   # VAR ~ 0 : compatible avec les deux, ne tranche pas
+            scales.add(fits[0])
+    if scales:
+        return scales.pop() if len(scales) == 1 else None
+    if g.pct_cells is not None and cells and all(cell in g.pct_cells for cell in cells):
+        return 100
+    return None
+
+
+def _pct_var(n, n1, var, scale: Optional[int]) -> Optional[float]:
+    """var_pct en % si cohérent avec n / n1 à l'échelle de la feuille (cf. _pct_scale)."""
+    if scale is None or None in (n, n1, var) or n1 == 0 or not _var_fits(n, n1, var, scale):
+        return None
+    return round(var * scale, 2)
+
+
+def _pct(v, scale: Optional[int]) -> Optional[float]:
+    """Valeur d'une cellule pourcentage → pourcentage, à l'échelle de la feuille (cf. _pct_scale)."""
+    return None if v is None or scale is None else round(v * scale, 2)
+
+
+class _Grid:
+    """Vue texte + valeurs d'une feuille, pour les recherches par libellé."""
+
+    def __init__(self, df: Optional[pd.DataFrame]):
+        self.cells = [] if df is None or df.empty else df.values.tolist()
+        self.text = [[_norm(v) for v in row] for row in self.cells]
+        # cellules au format pourcentage ; None si les formats n'ont pas été lus
+        self.pct_cells = None if df is None else df.attrs.get("pct_cells")
+
+    def find(self, pattern: str, start: int = 0, stop: Optional[int] = None) -> Optional[int]:
+        rx = re.compile(pattern)
+        for r in range(start, len(self.text) if stop is None else min(stop, len(self.text))):
+            if any(rx.search(t) for t in self.text[r]):
+                return r
+        return None
+
+    def label(self, r: int) -> str:
+        for v, t in zip(self.cells[r], self.text[r]):
+            if t and _num(v) is None:
+                return str(v).strip()
+        return ""
+
+    def numbers(self, r: int) -> List[Tuple[int, float]]:
+        return [(c, f) for c, f in ((c, _num(v)) for c, v in enumerate(self.cells[r])) if f is not None]
+
+    def is_header(self, r: int) -> bool:
+        texts = [t for v, t in zip(self.cells[r], self.text[r]) if t and _num(v) is None]
+        return len(texts) >= 2 and len(self.numbers(r)) <= 1
+
+    def column_labels(self, r: int) -> List[str]:
+        """Libellés de colonnes pour la ligne r : en-tête(s) juste au-dessus, groupes fusionnés propagés."""
+        headers = []
+        k = r - 1
+        while k >= 0 and r - k <= 6 and len(headers) < 2:
+            if self.is_header(k):
+                headers.insert(0, k)
+            elif headers:
+                break
+            k -= 1
+        width = len(self.cells[r]) if self.cells else 0
+        labels = [""] * width
+        for h in headers:
+            last = ""
+            for c in range(width):
+                t = self.text[h][c] if c < len(self.text[h]) else ""
+                if len(headers) > 1 and h == headers[0]:
+                    last = t or last   # ligne de groupes (cellules fusionnées)
+                    t = last
+                labels[c] = f"{labels[c]} {t}".strip()
+        return labels
+
+
+def _map_columns(labels: List[str], spec: List[Tuple[str, str]]) -> dict:
+    cols = {}
+    for c, lbl in enumerate(labels):
+        for field, pattern in spec:
+            if field not in cols and lbl and re.search(pattern, lbl):
+                cols[field] = c
+                break
+    return cols
+
+
+def _section_rows(g: _Grid, row_ok, section: str = r"hors (produits )?residentiel") -> List[int]:
+    """Lignes de données ; si la feuille a une section "hors résidentiel", seulement celle-ci."""
+    start = g.find(section)
+    rows = [r for r in range(len(g.cells)) if row_ok(r)]
+    if start is None:
+        return rows
+    end = g.find(r"^(?!.*hors).*residentiel", start + 1)
+    return [r for r in rows if start < r < (end if end is not None else len(g.cells))]
+
+
+def _rule_meta(sheets: dict) -> Optional[dict]:
+    meta = {}
+    for target in ("Couverture", "Suivi activite globale", "Vue synthétique"):
+        g = _Grid(sheets.get(target))
+        for r, row in enumerate(g.text):
+            for c, t in enumerate(row):
+                if "camping_name" not in meta and re.match(r"^camping\b", t):
+                    meta["camping_name"] = str(g.cells[r][c]).strip()
+                for key, pattern in (("date_observation", r"observation"), ("date_comparaison", r"comparaison")):
+                    if key not in meta and re.search(pattern, t):
+                        for v in g.cells[r][c + 1:]:
+                            if isinstance(v, datetime):
+                                meta[key] = v.strftime("%d/%m/%Y")
+                                break
+                            if re.match(r"^\d{1,2}/\d{1,2}/\d{4}$", _norm(v)):
+                                meta[key] = _norm(v)
+                                break
+    return meta if len(meta) == 3 else None
+
+
+def _hors_kpis(g: _Grid, section: str) -> Optional[Tuple[int, dict]]:
+    """Ligne "HORS PRODUITS RÉSIDENTIELS" d'une section : {indicateur: [(sous-libellé, valeur), ...]}."""
+    start = g.find(section)
+    if start is None:
+        return None
+    r = g.find(r"^hors produits residentiels", start + 1)
+    if r is None:
+        return None
+    labels = g.column_labels(r)
+    groups, metric = {}, None
+    for c, lbl in enumerate(labels):
+        # une colonne "VAR" sans indicateur dans son libellé suit celui de sa gauche
+        metric = next((m for m, pattern in KPI_METRICS if re.search(pattern, lbl)), metric)
+        v = _num(g.cells[r][c]) if c < len(g.cells[r]) else None
+        if metric and v is not None:
+            groups.setdefault(metric, []).append((lbl, v))
+    return r, groups
+
+
+def _split_group(values: List[Tuple[str, float]]) -> dict:
+    """Sépare n / n1 / var / var région / var réseau d'un groupe de colonnes."""
+    out, plain = {}, []
+    for lbl, v in values:
+        if re.search(r"region", lbl):
+            out["region"] = v
+        elif re.search(r"reseau", lbl):
+            out["reseau"] = v
+        else:
+            plain.append(v)
+    for key, v in zip(("n", "n1", "var"), plain):
+        out[key] = v
+    return out
+
+
+def _rule_kpis(g: _Grid) -> Tuple[Optional[dict], Optional[dict], Optional[dict], Optional[int]]:
+    """kpi_fermes, kpi_total, la partie chiffrée de benchmark et l'échelle des % de "Vue synthétique".
+
+    L'échelle (cf. _pct_scale) est recoupée sur les VAR de la feuille qui ont
+    leurs n / n1 ; elle vaut pour toutes ses colonnes en %.
+    """
+    kf = kt = bm = None
+    fermes, options = _hors_kpis(g, r"reservations fermes"), _hors_kpis(g, r"options et reservations")
+    triples = [(p.get("n"), p.get("n1"), p.get("var"))
+               for found in (fermes, options) if found
+               for m, v in found[1].items() if m != "taux_occupation"
+               for p in (_split_group(v),)]
+    scale = _pct_scale(g, triples)
+
+    found = fermes
+    if found:
+        groups = {m: _split_group(v) for m, v in found[1].items()}
+        kf = {}
+        for metric in ("ca", "sejours", "nuits", "prix_moyen_nuit", "taux_occupation", "revpar"):
+            p = groups.get(metric, {})
+            if metric == "taux_occupation":
+                n, n1 = _pct(p.get("n"), scale), _pct(p.get("n1"), scale)
+                if None in (n, n1, p.get("var")) or not (0 <= n <= 100 and 0 <= n1 <= 100):
+                    kf = None
+                    break
+                diff = n - n1
+                delta = next((d for d in (p["var"] * 100, p["var"]) if abs(d - diff) <= 0.05), None)
+                if delta is None:
+                    kf = None
+                    break
+                kf[metric] = {"n": n, "n1": n1, "delta_pts": round(delta, 2)}
+            else:
+                var = _pct_var(p.get("n"), p.get("n1"), p.get("var"), scale)
+                if var is None:
+                    kf = None
+                    break
+                digits = 2 if metric in ("prix_moyen_nuit", "revpar") else 0
+                kf[metric] = {"n": round(p["n"], digits), "n1": round(p["n1"], digits), "var_pct": var}
+                if digits == 0:
+                    kf[metric]["n"], kf[metric]["n1"] = int(kf[metric]["n"]), int(kf[metric]["n1"])
+
+        if kf and all(k in groups.get(m, {}) for m in ("ca", "sejours") for k in ("region", "reseau")):
+            bm = {
+                m: {"camping": kf[m]["var_pct"],
+                    "region": _pct(groups[m]["region"], scale),
+                    "reseau": _pct(groups[m]["reseau"], scale)}
+                for m in ("ca", "sejours")
+            }
+
+    found = options
+    stock_row = g.find(r"^stock\b")
+    if found:
+        groups = {m: _split_group(v) for m, v in found[1].items()}
+        kt = {}
+        for metric in ("ca", "sejours"):
+            p = groups.get(metric, {})
+            if "n1" in p and "var" in p:
+                var = _pct_var(p["n"], p["n1"], p["var"], scale)
+            elif "n1" in p:   # 2 colonnes seulement : n, var
+                var = _pct(p["n1"], scale)
+            else:
+                var = None
+            if var is None:
+                kt = None
+                break
+            kt[metric] = {"n": int(round(p["n"])), "var_pct": var}
+        stock = g.numbers(stock_row) if stock_row is not None else []
+        if kt is not None and stock:
+            kt["stock"] = int(round(stock[0][1]))
+        else:
+            kt = None
+
+    return kf, kt, bm, scale
+
+
+def _rule_benchmark_labels(sheets: dict) -> dict:
+    out = {"region_label": "Région", "region_nb": "", "reseau_label": "Réseau Sunêlia", "reseau_nb": ""}
+    g = _Grid(sheets.get("Suivi activite globale"))
+    for key, pattern in (("region", r"^region\b"), ("reseau", r"^reseau\b")):
+        r = g.find(pattern)
+        if r is None:
+            continue
+        for c, t in enumerate(g.text[r]):
+            if re.search(pattern, t):
+                out[f"{key}_label"] = str(g.cells[r][c]).strip()
+                nb = [f for cc, f in g.numbers(r) if cc > c]
+                if nb:
+                    out[f"{key}_nb"] = int(nb[0])
+                break
+    return out
+
+
+def _rule_series(df: Optional[pd.DataFrame], label_rx, key: str, fmt) -> Optional[list]:
+    """Séries n / n1 par date ou par semaine (lignes, ou colonnes si la feuille est transposée)."""
+    for frame in (df, None if df is None else df.T.reset_index(drop=True)):
+        g = _Grid(frame)
+        rows = _section_rows(g, lambda r: bool(label_rx(g.cells[r][0] if g.cells[r] else None)))
+        points = []
+        for r in rows:
+            nums = [f for c, f in g.numbers(r) if c > 0]
+            if len(nums) >= 2:
+                points.append({key: fmt(g.cells[r][0]), "n": round(nums[0]), "n1": round(nums[1])})
+        if len(points) >= 3:
+            return points
+    return None
+
+
+def _date_label(v) -> Optional[str]:
+    if isinstance(v, datetime):
+        return v.strftime("%d/%m")
+    m = _DATE_LABEL.match(_norm(v))
+    return f"{int(m.group(1)):02d}/{int(m.group(2)):02d}" if m else None
+
+
+def _rule_table(g: _Grid, rows: List[int], spec: List[Tuple[str, str]], order: List[str]) -> List[dict]:
+    """Lignes d'un tableau → dicts, colonnes repérées par en-tête (sinon dans l'ordre `order`).
+
+    "cells" : {champ: (ligne, colonne)} de chaque valeur (formats, cf. _pct_scale).
+    """
+    out = []
+    for r in rows:
+        cols = _map_columns(g.column_labels(r), spec)
+        if len(cols) < 2:
+            cols = dict(zip(order, (c for c, _ in g.numbers(r))))
+        cols = {f: c for f, c in cols.items() if c < len(g.cells[r])}
+        rec = {f: _num(g.cells[r][c]) for f, c in cols.items()}
+        out.append({"label": g.label(r), **rec, "cells": {f: (r, c) for f, c in cols.items()}})
+    return out
+
+
+def _rule_saisonnalite(g: _Grid, scale: Optional[int]) -> Optional[list]:
+    """Saisonnalité de "Vue synthétique", à l'échelle des % de la feuille (cf. _rule_kpis)."""
+    wanted = {_norm(p): p for p in SAISON_PERIODES}
+    last = {}
+    for r in range(len(g.cells)):
+        key = _norm(g.label(r))
+        if key in wanted and g.numbers(r):
+            last[key] = r   # section "réservations fermes" = dernière occurrence, en bas du tableau
+    if len(last) != len(wanted):
+        return None
+
+    rows = [last[_norm(p)] for p in SAISON_PERIODES]
+    out = []
+    for rec in _rule_table(g, rows, SAISON_COLUMNS, ["ca_n", "ca_n1", "var_pct", "sejours", "taux_occ"]):
+        var = _pct_var(rec.get("ca_n"), rec.get("ca_n1"), rec.get("var_pct"), scale)
+        taux_occ = _pct(rec.get("taux_occ"), scale)
+        if var is None or rec.get("sejours") is None or taux_occ is None or not 0 <= taux_occ <= 100:
+            return None
+        out.append({
+            "periode": rec["label"], "ca_n": round(rec["ca_n"]), "ca_n1": round(rec["ca_n1"]), "var_pct": var,
+            "sejours": round(rec["sejours"]), "taux_occ": taux_occ,
+            "is_haute": "haute" in _norm(rec["label"]),
+        })
+    return out
+
+
+def _rule_produits(sheets: dict) -> Optional[dict]:
+    g = _Grid(sheets.get("Ventes produit"))
+    rows = [r for r in range(len(g.cells)) if g.label(r) and g.numbers(r)]
+    recs = _rule_table(g, rows, PRODUIT_COLUMNS, ["ca", "var_pct", "sejours_n", "pmn"])
+    # pas de CA N-1 dans la feuille : l'échelle des VAR vient de leur format de cellule
+    scale = _pct_scale(g, cells=[x["cells"]["var_pct"] for x in recs if x.get("var_pct") is not None])
+    if scale is None:
+        return None
+
+    def bucket(exact: str, members: str) -> Optional[dict]:
+        chosen = [x for x in recs if re.match(exact, _norm(x["label"]))]
+        if not chosen:
+            chosen = [x for x in recs if re.search(members, _norm(x["label"])) and not re.search(r"total", _norm(x["label"]))]
+        if not chosen or any(x.get("ca") is None or x.get("var_pct") is None for x in chosen):
+            return None
+        ca = sum(x["ca"] for x in chosen)
+        var = [_pct(x["var_pct"], scale) for x in chosen]
+        ca_n1 = sum(x["ca"] / (1 + v / 100) for x, v in zip(chosen, var) if v > -100)
+        nights = sum(x["ca"] / x["pmn"] for x in chosen if x.get("pmn"))
+        return {
+            "ca": round(ca),
+            "var_pct": round((ca / ca_n1 - 1) * 100, 2) if ca_n1 else 0.0,
+            "sejours_n": round(sum(x.get("sejours_n") or 0 for x in chosen)),
+            "pmn": round(ca / nights, 2) if nights else 0.0,
+        }
+
+    loc = bucket(r"^location", r"mobil|cottage|chalet|lodge|locati|tente|bungalow")
+    emp = bucket(r"^emplacement", r"emplacement")
+    if not loc or not emp:
+        return None
+    return {"location": loc, "emplacement": emp, "total_ca": loc["ca"] + emp["ca"]}
+
+
+def _rule_bassins(sheets: dict) -> Optional[list]:
+    g = _Grid(sheets.get("Bassins emetteurs"))
+    rows = [r for r in range(len(g.cells)) if g.label(r) and g.numbers(r)]
+    recs = [x for x in _rule_table(g, rows, BASSIN_COLUMNS, ["ca", "var_pct"]) if x.get("ca") is not None]
+    scale = _pct_scale(g, cells=[x["cells"]["var_pct"] for x in recs if x.get("var_pct") is not None])
+    if scale is None:
+        return None
+    france = [x for x in recs if any(k in _norm(x["label"]) for k in REGIONS_FR)]
+    if len(france) < 3:
+        return None
+    total_row = next((x for x in recs if _norm(x["label"]) in ("france", "total france")), None)
+    total_fr = total_row["ca"] if total_row else sum(x["ca"] for x in france)
+    foreign = [x for x in recs if x not in france and x is not total_row and not re.search(r"total", _norm(x["label"]))
+               and x["ca"] >= 0.05 * total_fr]
+
+    top = sorted(france, key=lambda x: -x["ca"])[:8] + sorted(foreign, key=lambda x: -x["ca"])
+    return [{
+        "region": x["label"],
+        "ca": round(x["ca"]),
+        "pct_total": round(x["ca"] / total_fr * 100, 1) if total_fr else 0.0,
+        "var_pct": _pct(x.get("var_pct") or 0.0, scale),
+    } for x in top]
+
+
+def extract_structured(sheets: dict) -> Tuple[dict, List[str]]:
+    """Sections chiffrées de JSON_SCHEMA lues sans LLM.
+
+    Retourne (données, sections manquantes). Si la liste est vide, seul
+    `insights` reste à demander au LLM (build_insights_prompt).
+    """
+    vue = _Grid(sheets.get("Vue synthétique"))
+    kf, kt, bm_vals, scale = _rule_kpis(vue)
+    sections = {
+        "meta": _rule_meta(sheets),
+        "kpi_fermes": kf,
+        "kpi_total": kt,
+        "benchmark": {**bm_vals, **_rule_benchmark_labels(sheets)} if bm_vals else None,
+        "montee_charge": _rule_series(sheets.get("Montée en charge"), _date_label, "date", _date_label),
+        "ventes_semaine": _rule_series(sheets.get("Ventes sem."),
+                                       lambda v: bool(_WEEK_LABEL.search(_norm(v))), "sem", lambda v: str(v).strip()),
+        "produits": _rule_produits(sheets),
+        "saisonnalite": _rule_saisonnalite(vue, scale),
+        "bassins": _rule_bassins(sheets),
+    }
+    D = {k: v for k, v in sections.items() if v is not None}
+    return D, [k for k, v in sections.items() if v is None]
+
+
 # ═══════════════════════════════════════════════════════
 # 2. PROMPT + SCHÉMA JSON
 # ═══════════════════════════════════════════════════════
@@ -203,10 +1041,14 @@ JSON_SCHEMA = r"""
 """
 
 
-def build_prompt(data_text: str) -> str:
+# Schéma sur une ligne pour le prompt (les espaces d'alignement coûtent des tokens)
+JSON_SCHEMA_COMPACT = re.sub(r" {2,}", " ", re.sub(r"\s*\n\s*", "", JSON_SCHEMA))
+
+
+def build_prompt(data_text: str, compact: bool = True) -> str:
     return f"""Tu es un analyste expert en hôtellerie de plein air pour le réseau Sunêlia.
 
-DONNÉES BRUTES EXTRAITES DU RAPPORT EXCEL:
+DONNÉES BRUTES EXTRAITES DU RAPPORT EXCEL (une ligne par rangée Excel : R<n>|cellule|cellule, cellule vide = ||):
 ---
 {data_text}
 ---
@@ -214,7 +1056,7 @@ DONNÉES BRUTES EXTRAITES DU RAPPORT EXCEL:
 MISSION:
 Analyse ces données en profondeur. Extrais tous les indicateurs clés et retourne UNIQUEMENT un objet JSON valide (sans texte avant/après, sans backticks markdown) qui suit exactement ce schéma :
 
-{JSON_SCHEMA}
+{JSON_SCHEMA_COMPACT if compact else JSON_SCHEMA}
 
 RÈGLES STRICTES:
 1. Retourne UNIQUEMENT le JSON. Rien d'autre. Pas de texte, pas de ```, pas d'explication.
@@ -235,6 +1077,30 @@ RÈGLES STRICTES:
 JSON:"""
 
 
+def build_insights_prompt(D: dict) -> str:
+    """Prompt réduit : les chiffres sont déjà extraits (extract_structured), seul `insights` est demandé."""
+    figures = json.dumps(D, ensure_ascii=False, separators=(",", ":"))
+    return f"""Tu es un analyste expert en hôtellerie de plein air pour le réseau Sunêlia.
+
+INDICATEURS DU CAMPING (JSON, déjà calculés depuis le rapport Excel):
+---
+{figures}
+---
+
+MISSION:
+Rédige les insights de ce reporting et retourne UNIQUEMENT un objet JSON valide (sans texte avant/après, sans backticks markdown) :
+
+{{"insights": [{{"type": "positive|warning|alert|info", "title": "string", "text": "string"}}]}}
+
+RÈGLES STRICTES:
+1. Retourne UNIQUEMENT le JSON. Rien d'autre.
+2. EXACTEMENT 6 insights. Types variés (au moins 1 positive, 1 warning ou alert).
+3. Basés UNIQUEMENT sur les indicateurs ci-dessus. Pas d'invention. Concis. En français.
+4. Les variations sont en % (27.6 = +27,6%), delta_pts en points de taux d'occupation.
+
+JSON:"""
+
+
 # ═══════════════════════════════════════════════════════
 # 3. APPEL API SALESFORCE EINSTEIN
 # ═══════════════════════════════════════════════════════
@@ -256,20 +1122,263 @@ def get_sf_auth(org: str = "PROD") -> tuple[str, str]:
     return data["result"]["accessToken"], data["result"]["instanceUrl"]
 
 
-def call_einstein(prompt: str, token: str, instance_url: str) -> str:
-    url = f"{instance_url}/services/apexrest/einstein/generate"
-    payload = {"prompt": prompt, "model": "sfdc_ai__DefaultBedrockAnthropicClaude4Sonnet"}
-    resp = requests.post(
-        url,
-        json=payload,
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"},
-        timeout=180
-    )
-    resp.raise_for_status()
-    return resp.text
-
-
-def clean_json(raw: str) -> str:
+# sf ne donne pas l'expiration du token : durée de vie prudente (session
+# Salesforce de 2 h par défaut), un 401 force de toute façon le renouvellement.
+SF_TOKEN_TTL = 3600
+# Cache du token par utilisateur (jamais dans un dossier partagé comme /tmp)
+SF_TOKEN_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "crm-auto-reports"
+
+
+class SfAuth:
+    """Token Salesforce partagé par tous les rapports d'un run (et les runs suivants).
+
+    Obtenu au premier appel Einstein seulement (un run entièrement servi par
+    le cache n'appelle jamais sf), gardé en mémoire et sur disque avec son
+    expiration. refresh() n'est appelé que sur un 401 d'Einstein.
+    source() -> (token, instance_url) : `sf org display` par défaut, un faux
+    source s'injecte pour les tests. Un échec du source est mémorisé : les
+    autres workers ne relancent pas sf.
+    Le fichier (SF_TOKEN_DIR/sf_token_<org>.json) n'est relu que s'il
+    appartient à l'utilisateur courant et n'est lisible que par lui (0600) :
+    il fixe l'instance à qui partent le token et les prompts.
+    """
+
+    def __init__(self, org: str = "PROD", cache_path=None, source: Optional[Callable[[], Tuple[str, str]]] = None,
+                 ttl: float = SF_TOKEN_TTL, timer=None):
+        self.org = org
+        self.cache_path = Path(cache_path) if cache_path else SF_TOKEN_DIR / f"sf_token_{org}.json"
+        self.source = source or (lambda: get_sf_auth(org))
+        self.ttl = ttl
+        self.timer = timer
+        self.fetches = 0
+        self._token = self._instance_url = None
+        self._expires = 0.0
+        self._error = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Tuple[str, str]:
+        with self._lock:
+            if self._token and time.time() < self._expires:
+                return self._token, self._instance_url
+            if self._error:
+                raise self._error
+            if self._load():
+                print(f"        ✓ Token Salesforce réutilisé (expire dans {(self._expires - time.time()) / 60:.0f} min)")
+                return self._token, self._instance_url
+
+            print(f"  Authentification Salesforce ({self.org})...")
+            try:
+                with (self.timer.stage("auth") if self.timer else contextlib.nullcontext()):
+                    self._token, self._instance_url = self.source()
+            except Exception as e:
+                self._error = e
+                raise
+            self.fetches += 1
+            self._expires = time.time() + self.ttl
+            self._save()
+            print("        ✓ Token obtenu")
+            return self._token, self._instance_url
+
+    def refresh(self, stale_token: str) -> Tuple[str, str]:
+        """Oublie `stale_token` (refusé par l'API) et en obtient un nouveau.
+        Si un autre worker l'a déjà remplacé, le nouveau est simplement renvoyé."""
+        with self._lock:
+            if self._token == stale_token:
+                self._token = None
+                self.cache_path.unlink(missing_ok=True)
+        return self.get()
+
+    def _load(self) -> bool:
+        try:
+            fd = os.open(self.cache_path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+        except OSError:
+            return False
+        try:
+            st = os.fstat(fd)
+            if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+                print(f"        ⚠ Cache du token ignoré ({self.cache_path} : propriétaire ou droits incorrects)")
+                return False
+            with os.fdopen(fd, encoding="utf-8") as f:
+                fd = None
+                data = json.loads(f.read())
+        except (OSError, ValueError):
+            return False
+        finally:
+            if fd is not None:
+                os.close(fd)
+        if data.get("org") != self.org or time.time() >= data.get("expires", 0):
+            return False
+        self._token, self._instance_url, self._expires = data["token"], data["instance_url"], data["expires"]
+        return True
+
+    def _save(self):
+        payload = json.dumps({"org": self.org, "token": self._token, "instance_url": self._instance_url,
+                              "expires": self._expires})
+        tmp = None
+        try:
+            self.cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # mkstemp : nom imprévisible, créé en 0600, dans le dossier du cache (os.replace atomique)
+            fd, tmp = tempfile.mkstemp(prefix=f".{self.cache_path.name}.", suffix=".tmp", dir=self.cache_path.parent)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            if tmp:
+                Path(tmp).unlink(missing_ok=True)
+            print(f"        ⚠ Token non mis en cache ({e})")
+
+
+EINSTEIN_MODEL = "sfdc_ai__DefaultBedrockAnthropicClaude4Sonnet"
+EINSTEIN_RETRY_STATUS = (429, 502, 503, 504)
+EINSTEIN_MAX_ATTEMPTS = 5
+EINSTEIN_TIMEOUT = 180
+EINSTEIN_POOL_SIZE = 8
+
+
+class EinsteinLimiter:
+    """Borne le nombre d'appels Einstein simultanés et s'adapte aux 429/503.
+
+    Sur un refus (throttling) : la limite est divisée par deux et tous les
+    workers attendent la fin de la pause. Chaque succès la remonte de 1
+    jusqu'à max_inflight.
+    """
+
+    def __init__(self, max_inflight: int = 4):
+        self.max_inflight = max(1, int(max_inflight))
+        self.limit = self.max_inflight
+        self.inflight = 0
+        self.resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.inflight < self.limit:
+                    self.inflight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, throttled_for: Optional[float] = None):
+        with self._cond:
+            self.inflight -= 1
+            if throttled_for is not None:
+                self.limit = max(1, self.limit // 2)
+                self.resume_at = max(self.resume_at, time.monotonic() + throttled_for)
+            elif self.limit < self.max_inflight:
+                self.limit += 1
+            self._cond.notify_all()
+
+
+def _retry_delay(resp, attempt: int) -> float:
+    retry_after = resp.headers.get("Retry-After", "") if resp is not None else ""
+    if retry_after.strip().isdigit():
+        return float(retry_after.strip())
+    return min(60.0, 2.0 ** attempt) + random.uniform(0, 1)
+
+
+class EinsteinClient:
+    """Session HTTP partagée par tous les appels Einstein d'un run.
+
+    Les connexions (TCP + TLS) vers l'instance restent ouvertes et sont
+    réutilisées d'un rapport à l'autre, jusqu'à pool_size en parallèle.
+    Reprises : connexion refusée/coupée et 429/502/503/504 (pause Retry-After
+    ou backoff, limiter prévenu), 401 → token renouvelé une fois via `auth`
+    (sans consommer d'essai : le nouvel appel a lieu même après le dernier).
+    La réponse est lue en flux et décodée selon le charset du Content-Type,
+    UTF-8 à défaut, sans détection de charset.
+    """
+
+    def __init__(self, pool_size: int = EINSTEIN_POOL_SIZE, timeout: float = EINSTEIN_TIMEOUT,
+                 max_attempts: int = EINSTEIN_MAX_ATTEMPTS):
+        from requests.adapters import HTTPAdapter
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    @staticmethod
+    def _read_text(resp) -> str:
+        body = b"".join(resp.iter_content(chunk_size=64 * 1024))
+        # pas resp.encoding : requests suppose ISO-8859-1 pour text/* sans charset
+        charset = re.search(r"charset=[\"']?([\w.:-]+)", resp.headers.get("Content-Type", ""), re.I)
+        try:
+            return body.decode(charset.group(1) if charset else "utf-8", errors="replace")
+        except LookupError:
+            return body.decode("utf-8", errors="replace")
+
+    def generate(self, prompt: str, token: str = "", instance_url: str = "",
+                 limiter: Optional[EinsteinLimiter] = None, auth: Optional[SfAuth] = None) -> str:
+        if auth:
+            token, instance_url = auth.get()
+        payload = {"prompt": prompt, "model": EINSTEIN_MODEL}
+        refreshed = False
+
+        attempt = 0
+        while attempt < self.max_attempts:
+            attempt += 1
+            if limiter:
+                limiter.acquire()
+            delay, throttled = None, False
+            try:
+                with self.session.post(
+                    f"{instance_url}/services/apexrest/einstein/generate",
+                    json=payload,
+                    headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"},
+                    timeout=self.timeout,
+                    stream=True,
+                ) as resp:
+                    status = resp.status_code
+                    if status == 401 and auth and not refreshed:
+                        print("        ⚠ HTTP 401 : token expiré, renouvellement")
+                        token, instance_url = auth.refresh(token)
+                        refreshed, attempt = True, attempt - 1
+                        continue
+                    if status not in EINSTEIN_RETRY_STATUS or attempt == self.max_attempts:
+                        resp.raise_for_status()
+                        return self._read_text(resp)
+                    delay, throttled = _retry_delay(resp, attempt), True
+                    reason = f"HTTP {status}"
+            except requests.ConnectionError as e:
+                if attempt == self.max_attempts:
+                    raise
+                # Connexion keep-alive fermée par le serveur : nouvel essai immédiat
+                # sur une connexion neuve, backoff ensuite. Pas un signal de charge.
+                delay = 0.0 if attempt == 1 else _retry_delay(None, attempt)
+                reason = f"connexion: {type(e).__name__}"
+            finally:
+                if limiter:
+                    limiter.release(delay if throttled else None)
+
+            print(f"        ⚠ {reason} (essai {attempt}/{self.max_attempts}), pause {delay:.0f}s")
+            if delay and not (limiter and throttled):
+                time.sleep(delay)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_einstein_client() -> EinsteinClient:
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = EinsteinClient()
+        return _default_client
+
+
+def call_einstein(prompt: str, token: str = "", instance_url: str = "", limiter: Optional[EinsteinLimiter] = None,
+                  auth: Optional[SfAuth] = None, client: Optional[EinsteinClient] = None) -> str:
+    """Appel Einstein via `client` (par défaut une session partagée par le process)."""
+    return (client or default_einstein_client()).generate(prompt, token, instance_url, limiter=limiter, auth=auth)
+
+
+def clean_json(raw: str, required_key: str = "meta") -> str:
     raw = raw.strip()
     data = raw
 
@@ -288,10 +1397,10 @@ def clean_json(raw: str) -> str:
             data = data["text"]
             continue
 
-        if isinstance(data, dict) and "meta" in data:
+        if isinstance(data, dict) and required_key in data:
             return json.dumps(data, ensure_ascii=False)
 
-    if isinstance(data, dict) and "meta" in data:
+    if isinstance(data, dict) and required_key in data:
         return json.dumps(data, ensure_ascii=False)
 
     raise ValueError(
@@ -299,6 +1408,71 @@ def clean_json(raw: str) -> str:
     )
 
 
+class EinsteinCache:
+    """Cache disque des réponses Einstein (JSON nettoyé), adressé par contenu.
+
+    Clé = sha256(modèle + prompt) : un Excel retraité à l'identique ne
+    repasse pas par le LLM. Les entrées expirent ttl_days après leur
+    création, même si elles sont relues entre-temps, et le cache est borné
+    à max_mb (les moins récemment utilisées partent en premier).
+    Fichier d'une entrée : date de création (epoch) sur la première ligne,
+    puis le JSON ; le mtime ne sert qu'au LRU. Le dossier n'est créé qu'à la
+    première écriture.
+    """
+
+    def __init__(self, directory, ttl_days: float = 14, max_mb: float = 50):
+        self.dir = Path(directory)
+        self.ttl = ttl_days * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def key(self, prompt: str, model: str = EINSTEIN_MODEL) -> str:
+        return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, prompt: str, model: str = EINSTEIN_MODEL) -> Optional[str]:
+        path = self.dir / f"{self.key(prompt, model)}.json"
+        try:
+            created, _, json_str = path.read_text(encoding="utf-8").partition("\n")
+        except FileNotFoundError:
+            return None
+        try:
+            expired = time.time() - float(created) > self.ttl
+        except ValueError:
+            expired = True   # entrée d'un format antérieur, sans date de création
+        if expired:
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # LRU : une entrée relue redevient récente (sans repousser son expiration)
+        return json_str
+
+    def put(self, prompt: str, json_str: str, model: str = EINSTEIN_MODEL):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{time.time():.0f}\n{json_str}")
+        os.replace(tmp, self.dir / f"{self.key(prompt, model)}.json")
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for path in self.dir.glob("*.json"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.ttl:   # inutilisée depuis ttl : forcément créée avant
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
 # ═══════════════════════════════════════════════════════
 # 4. FORMAT + HTML EMAIL-SAFE
 # ═══════════════════════════════════════════════════════
@@ -402,6 +1576,35 @@ def _mpl_setup():
     plt.rcParams["ytick.color"] = THEME["muted"]
 
 
+# Profils d'image du mail, du plus lourd au plus léger (ordre de repli quand
+# le mail dépasse son budget, cf. build_report_eml) :
+#   dpi      : résolution de savefig ("figure" = celle du tracé, 170-180 dpi)
+#   colors   : PNG en palette de n couleurs, sans tramage (0 = couleurs vraies)
+#   compress : niveau zlib du PNG ré-encodé (None = PNG matplotlib tel quel)
+# Mesuré sur un rapport réel (5 graphiques) : retina ~350 Ko, standard ~65 Ko,
+# light ~40 Ko, avant l'encodage base64 du mail (+33 %).
+IMAGE_PROFILES = {
+    "retina":   {"dpi": "figure", "colors": 0,   "compress": None},
+    "standard": {"dpi": 120,      "colors": 256, "compress": 6},
+    "light":    {"dpi": 80,       "colors": 64,  "compress": 9},
+}
+
+
+def encode_png(png: bytes, profile: str) -> bytes:
+    """Ré-encode un PNG matplotlib selon le profil (palette, compression)."""
+    cfg = IMAGE_PROFILES[profile]
+    if not cfg["colors"] and cfg["compress"] is None:
+        return png
+    from PIL import Image  # dépendance de matplotlib
+
+    img = Image.open(BytesIO(png)).convert("RGB")   # fond blanc opaque : le canal alpha est inutile
+    if cfg["colors"]:
+        img = img.quantize(cfg["colors"], method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    buf = BytesIO()
+    img.save(buf, format="PNG", compress_level=6 if cfg["compress"] is None else cfg["compress"])
+    return buf.getvalue()
+
+
 def plot_montee_charge(data: dict) -> bytes:
     _mpl_setup()
     x = [d.get("date", "") for d in data.get("montee_charge", [])]
@@ -424,7 +1627,7 @@ def plot_montee_charge(data: dict) -> bytes:
     ax.tick_params(axis="x", labelrotation=45, labelsize=8)
     ax.tick_params(axis="y", labelsize=8)
 
-    ax.yaxis.set_major_formatter(FuncFormatter(lambda v, _: f"{int(v/1000)}k€"))
+    ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda v, _: f"{int(v/1000)}k€"))
     ax.legend(loc="upper left", fontsize=8, frameon=False)
 
     fig.tight_layout()
@@ -454,7 +1657,7 @@ def plot_ventes_semaine(data: dict) -> bytes:
     ax.tick_params(axis="y", labelsize=8)
     ax.grid(True, axis="y", alpha=0.22)
     ax.set_title("CA par semaine d'occupation", fontsize=11, color=THEME["text"])
-    ax.yaxis.set_major_formatter(FuncFormatter(lambda v, _: f"{int(v/1000)}k€"))
+    ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda v, _: f"{int(v/1000)}k€"))
     ax.legend(loc="upper left", fontsize=8, frameon=False)
 
     fig.tight_layout()
@@ -530,109 +1733,126 @@ def nice_scale_max(values: List[float]) -> float:
     return float(int((mx + 9) // 10) * 10)
 
 
-def _draw_speedometer(ax, value: float, label: str, ring_color: str, scale_max: float):
+def _gauge_value(value) -> float:
     try:
         v = float(value)
         if math.isnan(v) or math.isinf(v):
             v = 0.0
     except Exception:
         v = 0.0
-
-    v = max(-scale_max, min(scale_max, v))
-    angle = 90.0 - (v / scale_max) * 90.0 if scale_max > 0 else 90.0  # -max=180, 0=90, +max=0
-
-    ax.set_aspect("equal")
-    ax.axis("off")
-    ax.set_xlim(-1.2, 1.2)
-    ax.set_ylim(-0.25, 1.25)
-
-    # Card background (premium)
-    card = FancyBboxPatch(
-        (-1.15, -0.22), 2.30, 1.45,
-        boxstyle="round,pad=0.02,rounding_size=0.14",
-        linewidth=0.9, edgecolor=THEME["border"], facecolor=THEME["surface"]
-    )
-    ax.add_patch(card)
-
-    # Inner panel
-    panel = FancyBboxPatch(
-        (-1.05, -0.12), 2.10, 1.25,
-        boxstyle="round,pad=0.02,rounding_size=0.12",
-        linewidth=0.0, facecolor=THEME["panel"]
-    )
-    ax.add_patch(panel)
-
-    r = 0.95
-    width = 0.18
-
-    # Background arc
-    bg = Wedge((0, 0), r, 0, 180, width=width, facecolor="#dfecee", edgecolor="none")
-    ax.add_patch(bg)
-
-    # Value arc from 0 baseline (90°)
-    if v != 0:
-        if v >= 0:
-            theta1, theta2 = angle, 90.0
-        else:
-            theta1, theta2 = 90.0, angle
-        if not (math.isnan(theta1) or math.isnan(theta2)) and abs(theta2 - theta1) > 0.01:
-            arc = Wedge((0, 0), r, theta1, theta2, width=width, facecolor=ring_color, edgecolor="none")
-            ax.add_patch(arc)
-
-    # Ticks
-    ax.text(-r, -0.02, f"-{int(scale_max)}%", ha="left", va="top", fontsize=7.5, color=THEME["muted2"])
-    ax.text(0,  r+0.02, "0", ha="center", va="bottom", fontsize=8.5, color=THEME["muted2"], fontweight="bold")
-    ax.text(r,  -0.02, f"+{int(scale_max)}%", ha="right", va="top", fontsize=7.5, color=THEME["muted2"])
-
-    # Needle
-    ang = math.radians(angle)
-    x = math.cos(ang) * (r - 0.10)
-    y = math.sin(ang) * (r - 0.10)
-    ax.plot([0, x], [0, y], linewidth=2.2, color=THEME["text"], solid_capstyle="round")
-    ax.add_patch(Circle((0, 0), 0.04, facecolor=THEME["text"], edgecolor="none"))
-
-    # Value text
-    val_color = THEME["good"] if v > 0 else THEME["bad"] if v < 0 else THEME["muted"]
-    sign = "+" if v > 0 else ""
-    ax.text(0, 0.42, f"{sign}{v:.1f}%", ha="center", va="center",
-            fontsize=13, fontweight="bold", color=val_color)
-
-    # Label
-    ax.text(0, 0.17, label, ha="center", va="center",
-            fontsize=8.6, color=THEME["text"], fontweight="bold")
-
-    # Subtitle
-    ax.text(0, -0.11, f"Échelle ±{int(scale_max)}%", ha="center", va="center",
-            fontsize=7.2, color=THEME["muted2"])
+    return v
+
+
+class _GaugeTemplate:
+    """Figure de n jauges construite une fois par process, réutilisée à chaque rendu.
+
+    Les artistes fixes (cartes, arc de fond, moyeu, "0") sont créés une seule
+    fois ; seuls l'arc de valeur, l'aiguille et les textes sont mis à jour
+    avant savefig. L'ordre de création est celui de l'ancien tracé, pour un
+    rendu identique.
+    """
+
+    R = 0.95
+    WIDTH = 0.18
+
+    def __init__(self, n: int):
+        _mpl_setup()
+        self.fig = plt.figure(figsize=(9.2, 2.9), dpi=180)
+        self.fig.patch.set_facecolor("white")
+        self.title = self.fig.suptitle("", fontsize=11, fontweight="bold", y=0.98, color=THEME["text"])
+        self.gauges = [self._build(self.fig.add_subplot(1, n, i + 1)) for i in range(n)]
+        sp = self.fig.subplotpars
+        self.layout = dict(left=sp.left, right=sp.right, bottom=sp.bottom, top=sp.top, wspace=sp.wspace, hspace=sp.hspace)
+
+    def _build(self, ax) -> dict:
+        r, width = self.R, self.WIDTH
+        ax.set_aspect("equal")
+        ax.axis("off")
+        ax.set_xlim(-1.2, 1.2)
+        ax.set_ylim(-0.25, 1.25)
+
+        # Card background (premium)
+        ax.add_patch(mpatches.FancyBboxPatch(
+            (-1.15, -0.22), 2.30, 1.45,
+            boxstyle="round,pad=0.02,rounding_size=0.14",
+            linewidth=0.9, edgecolor=THEME["border"], facecolor=THEME["surface"]
+        ))
+        # Inner panel
+        ax.add_patch(mpatches.FancyBboxPatch(
+            (-1.05, -0.12), 2.10, 1.25,
+            boxstyle="round,pad=0.02,rounding_size=0.12",
+            linewidth=0.0, facecolor=THEME["panel"]
+        ))
+        # Background arc
+        ax.add_patch(mpatches.Wedge((0, 0), r, 0, 180, width=width, facecolor="#dfecee", edgecolor="none"))
+
+        g = {}
+        # Value arc from 0 baseline (90°), masqué si la valeur est nulle
+        g["arc"] = mpatches.Wedge((0, 0), r, 90, 90, width=width, edgecolor="none")
+        ax.add_patch(g["arc"])
+
+        # Ticks
+        g["tick_min"] = ax.text(-r, -0.02, "", ha="left", va="top", fontsize=7.5, color=THEME["muted2"])
+        ax.text(0,  r+0.02, "0", ha="center", va="bottom", fontsize=8.5, color=THEME["muted2"], fontweight="bold")
+        g["tick_max"] = ax.text(r,  -0.02, "", ha="right", va="top", fontsize=7.5, color=THEME["muted2"])
+
+        # Needle
+        g["needle"], = ax.plot([0, 0], [0, 0], linewidth=2.2, color=THEME["text"], solid_capstyle="round")
+        ax.add_patch(mpatches.Circle((0, 0), 0.04, facecolor=THEME["text"], edgecolor="none"))
+
+        # Value text, label, subtitle
+        g["value"] = ax.text(0, 0.42, "", ha="center", va="center", fontsize=13, fontweight="bold")
+        g["label"] = ax.text(0, 0.17, "", ha="center", va="center",
+                             fontsize=8.6, color=THEME["text"], fontweight="bold")
+        g["scale"] = ax.text(0, -0.11, "", ha="center", va="center", fontsize=7.2, color=THEME["muted2"])
+        return g
+
+    def update(self, g: dict, value: float, label: str, ring_color: str, scale_max: float):
+        v = max(-scale_max, min(scale_max, _gauge_value(value)))
+        angle = 90.0 - (v / scale_max) * 90.0 if scale_max > 0 else 90.0  # -max=180, 0=90, +max=0
+
+        theta1, theta2 = (angle, 90.0) if v >= 0 else (90.0, angle)
+        g["arc"].set_visible(v != 0 and abs(theta2 - theta1) > 0.01)
+        g["arc"].set(theta1=theta1, theta2=theta2, facecolor=ring_color)
+
+        g["tick_min"].set_text(f"-{int(scale_max)}%")
+        g["tick_max"].set_text(f"+{int(scale_max)}%")
+
+        ang = math.radians(angle)
+        g["needle"].set_data([0, math.cos(ang) * (self.R - 0.10)], [0, math.sin(ang) * (self.R - 0.10)])
+
+        sign = "+" if v > 0 else ""
+        g["value"].set_text(f"{sign}{v:.1f}%")
+        g["value"].set_color(THEME["good"] if v > 0 else THEME["bad"] if v < 0 else THEME["muted"])
+        g["label"].set_text(label)
+        g["scale"].set_text(f"Échelle ±{int(scale_max)}%")
+
+    def render(self, title: str, items: List[Tuple[str, float, str]], scale_max: float) -> bytes:
+        self.title.set_text(title)
+        for g, (lbl, val, col) in zip(self.gauges, items):
+            self.update(g, val, lbl, col, scale_max)
+        self.fig.subplots_adjust(**self.layout)   # tight_layout repart de la mise en page initiale
+        self.fig.tight_layout(rect=[0, 0, 1, 0.92])
+        buf = BytesIO()
+        self.fig.savefig(buf, format="png", bbox_inches="tight")
+        return buf.getvalue()
+
+
+# Un gabarit par nombre de jauges ; jamais partagé entre threads (_RENDER_LOCK ou process dédié)
+_GAUGE_TEMPLATES = {}
 
 
 def plot_benchmark_speedometers(title: str, items: List[Tuple[str, float, str]], scale_max: Optional[float] = None) -> bytes:
-    _mpl_setup()
-    vals = [float(v or 0) for _, v, _ in items]
+    vals = [_gauge_value(v) for _, v, _ in items]
     if scale_max is None:
         scale_max = nice_scale_max(vals)
     if scale_max < 1.0:
         scale_max = 10.0
 
-    fig = plt.figure(figsize=(9.2, 2.9), dpi=180)
-    fig.patch.set_facecolor("white")
-    fig.suptitle(title, fontsize=11, fontweight="bold", y=0.98, color=THEME["text"])
-
     n = len(items)
-    for i, (lbl, val, col) in enumerate(items):
-        ax = fig.add_subplot(1, n, i + 1)
-        try:
-            _draw_speedometer(ax, val, lbl, col, scale_max)
-        except Exception:
-            ax.text(0.5, 0.5, f"{lbl}\nN/A", ha="center", va="center",
-                    fontsize=10, color="#6f8590", transform=ax.transAxes)
-            ax.axis("off")
-
-    fig.tight_layout(rect=[0, 0, 1, 0.92])
-    buf = BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight")
-    plt.close(fig)
-    return buf.getvalue()
+    if n not in _GAUGE_TEMPLATES:
+        _GAUGE_TEMPLATES[n] = _GaugeTemplate(n)
+    return _GAUGE_TEMPLATES[n].render(title, items, scale_max)
 
 
 # ═══════════════════════════════════════════════════════
@@ -1001,25 +2221,88 @@ def build_eml_message(
     from_addr: str,
     to_addr: str,
     subject: str,
-    img_mc: bytes,
-    img_wk: bytes,
-    img_donut: bytes,
-    img_bm_ca: bytes,
-    img_bm_sj: bytes
+    images: dict,
+    timer: Optional["StageTimer"] = None,
+    attachments: Optional[List[Tuple[str, bytes]]] = None,
+    sizes: Optional[dict] = None,
 ) -> bytes:
-    cids = {"mc": "mc_chart", "wk": "wk_chart", "donut": "donut_chart", "bm_ca": "bm_ca", "bm_sj": "bm_sj"}
-
-    msg_root = MIMEMultipart("related")
+    """Assemble le .eml ; images = {Content-ID: PNG} (voir render_charts).
+
+    attachments = [(nom de fichier, contenu)] : pièces jointes xlsx ajoutées
+    au message, qui est alors prêt à partir tel quel (encodé une seule fois).
+    sizes (dict) est rempli avec la taille du mail par famille de parties
+    (cf. mime_sizes), calculée sur les parties avant assemblage.
+    """
+    timer = timer or StageTimer()
+    cids = {key: cid for key, cid, _ in CHARTS}
+    attachments = attachments or []
+
+    with timer.stage("html"):
+        txt = build_plain_text(D)
+        html = build_email_html(D, cids)
+
+    with timer.stage("mime"):
+        eml_bytes = _assemble_mime(subject, from_addr, to_addr, txt, html, images, attachments)
+    if sizes is not None:
+        sizes.update(mime_sizes(eml_bytes, txt, html, images, attachments))
+    return eml_bytes
+
+
+def _b64_size(n: int) -> int:
+    """Octets d'un contenu de n octets encodé base64 dans le mail (lignes de 76 + CRLF)."""
+    encoded = 4 * -(-n // 3)
+    return encoded + 2 * -(-encoded // 76)
+
+
+def mime_sizes(eml_bytes: bytes, txt: str, html: str, images: dict,
+               attachments: List[Tuple[str, bytes]]) -> dict:
+    """Taille du mail par famille de parties, en octets tels qu'encodés (base64 compris).
+
+    {"total", "images", "html", "text", "attachments", "headers"} ; "headers"
+    regroupe en-têtes et délimiteurs MIME (le reste de "total"). Calculé sur
+    les parties (toutes en base64), sans reparser le message.
+    """
+    sizes = {
+        "total": len(eml_bytes),
+        "images": sum(_b64_size(len(png)) for png in images.values()),
+        "html": _b64_size(len(html.encode("utf-8"))),
+        "text": _b64_size(len(txt.encode("utf-8"))),
+        "attachments": sum(_b64_size(len(data)) for _, data in attachments),
+    }
+    sizes["headers"] = sizes["total"] - sum(sizes[k] for k in ("images", "html", "text", "attachments"))
+    return sizes
+
+
+XLSX_SUBTYPE = "vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def attachment_part(filename: str, data: bytes):
+    """Pièce jointe xlsx ; nom non ASCII ou long encodé RFC 2231 (filename*=...)."""
+    from email.mime.application import MIMEApplication
+
+    part = MIMEApplication(data, _subtype=XLSX_SUBTYPE)
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    return part
+
+
+def _assemble_mime(subject: str, from_addr: str, to_addr: str, txt: str, html: str, images: dict,
+                   attachments: List[Tuple[str, bytes]]) -> bytes:
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.image import MIMEImage
+    from email import policy
+    from email.utils import make_msgid
+
+    # policy SMTP : en-têtes non ASCII (sujet "Sunêlia — ...") encodés RFC 2047
+    msg_root = MIMEMultipart("related", policy=policy.SMTP)
     msg_root["Subject"] = subject
     msg_root["From"] = from_addr
     msg_root["To"] = to_addr
+    msg_root["Message-ID"] = make_msgid(domain=from_addr.rpartition("@")[2] or None)
 
     msg_alt = MIMEMultipart("alternative")
     msg_root.attach(msg_alt)
 
-    txt = build_plain_text(D)
-    html = build_email_html(D, cids)
-
     msg_alt.attach(MIMEText(txt, "plain", "utf-8"))
     msg_alt.attach(MIMEText(html, "html", "utf-8"))
 
@@ -1029,37 +2312,887 @@ def build_eml_message(
         part.add_header("Content-Disposition", "inline", filename=filename)
         msg_root.attach(part)
 
-    attach_img(img_mc, cids["mc"], "montee_charge.png")
-    attach_img(img_wk, cids["wk"], "ventes_semaine.png")
-    attach_img(img_donut, cids["donut"], "produits.png")
-    attach_img(img_bm_ca, cids["bm_ca"], "benchmark_ca.png")
-    attach_img(img_bm_sj, cids["bm_sj"], "benchmark_sejours.png")
+    for _, cid, filename in CHARTS:
+        attach_img(images[cid], cid, filename)
+
+    for filename, data in attachments:
+        msg_root.attach(attachment_part(filename, data))
 
     return msg_root.as_bytes(policy=policy.SMTP)
 
 
 # ═══════════════════════════════════════════════════════
-# 7. MAIN
+# 7. GÉNÉRATION (unitaire + batch)
+# ═══════════════════════════════════════════════════════
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def write_atomic(path: Path, data) -> Path:
+    """Écrit un fichier d'un bloc : fichier temporaire du même dossier puis os.replace.
+
+    Un lecteur (ou un autre générateur) voit l'ancien contenu ou le nouveau,
+    jamais un fichier à moitié écrit. data : str (UTF-8) ou bytes.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_bytes(data.encode("utf-8") if isinstance(data, str) else data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return path
+
+
+class StageTimer:
+    """Temps mur, temps CPU et pic mémoire par étape du pipeline d'un rapport.
+
+    cpu_s   : temps CPU du thread qui exécute l'étape (du process de rendu
+              pour les graphiques rendus dans le pool).
+    peak_mb : pic RSS du process à la fin de l'étape. C'est un maximum depuis
+              le démarrage, pas une mesure isolée de l'étape (None sous Windows).
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        w0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - w0, time.thread_time() - c0, peak_rss_mb())
+
+    def add(self, name: str, wall_s: float, cpu_s: float, peak_mb: Optional[float] = None):
+        with self._lock:
+            st = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "peak_mb": None})
+            st["wall_s"] = round(st["wall_s"] + wall_s, 4)
+            st["cpu_s"] = round(st["cpu_s"] + cpu_s, 4)
+            if peak_mb is not None:
+                st["peak_mb"] = max(st["peak_mb"] or 0.0, peak_mb)
+
+    def write(self, path: Path) -> Path:
+        return write_atomic(path, json.dumps(self.stages, ensure_ascii=False, indent=2))
+
+
+# Graphiques du mail : (clé dans build_email_html, Content-ID, nom de fichier)
+CHARTS = [
+    ("mc",    "mc_chart",    "montee_charge.png"),
+    ("wk",    "wk_chart",    "ventes_semaine.png"),
+    ("donut", "donut_chart", "produits.png"),
+    ("bm_ca", "bm_ca",       "benchmark_ca.png"),
+    ("bm_sj", "bm_sj",       "benchmark_sejours.png"),
+]
+
+# pyplot n'est pas thread-safe : rendu en process (render_charts sans pool) sérialisé
+_RENDER_LOCK = threading.Lock()
+
+
+def chart_jobs(D: dict) -> List[Tuple[str, object, tuple]]:
+    """Graphiques d'un rapport : [(Content-ID, fonction de tracé, arguments), ...]."""
+    # PREMIUM Benchmark speedometers (3 jauges horizontales)
+    bm = D.get("benchmark", {}) or {}
+    camp_name_short = D.get("meta", {}).get("camping_name", "Camping").replace("Camping Sunêlia ", "")
+    region_lbl = f"{bm.get('region_label','Région')} ({bm.get('region_nb','')})".strip()
+    reseau_lbl = f"{bm.get('reseau_label','Réseau')} ({bm.get('reseau_nb','')})".strip()
+
+    ca_vals = bm.get("ca", {}) or {}
+    sj_vals = bm.get("sejours", {}) or {}
+
+    # Couleurs différenciées mais cohérentes avec le thème
+    c_camping = THEME["teal_500"]
+    c_region  = THEME["teal_900"]
+    c_reseau  = THEME["teal_600"]
+
+    def gauges(vals: dict) -> list:
+        return [
+            (camp_name_short, float(vals.get("camping", 0) or 0), c_camping),
+            (region_lbl,      float(vals.get("region", 0) or 0), c_region),
+            (reseau_lbl,      float(vals.get("reseau", 0) or 0), c_reseau),
+        ]
+
+    cid = {key: cid for key, cid, _ in CHARTS}
+    return [
+        (cid["mc"],    plot_montee_charge,  (D,)),
+        (cid["wk"],    plot_ventes_semaine, (D,)),
+        (cid["donut"], plot_produits_donut, (D,)),
+        (cid["bm_ca"], plot_benchmark_speedometers, ("Positionnement — Variation du CA", gauges(ca_vals), None)),
+        (cid["bm_sj"], plot_benchmark_speedometers, ("Positionnement — Variation du nombre de séjours", gauges(sj_vals), None)),
+    ]
+
+
+def _render_job(job: Tuple[str, object, tuple, str]) -> Tuple[str, bytes, float, float, Optional[float]]:
+    """Rend un graphique dans un profil d'image : (Content-ID, PNG, temps mur, temps CPU, pic RSS du process)."""
+    cid, plot, args, profile = job
+    w0, c0 = time.perf_counter(), time.thread_time()
+    # les tracés appellent savefig sans dpi : savefig.dpi s'applique
+    with plt.rc_context({"savefig.dpi": IMAGE_PROFILES[profile]["dpi"]}):
+        png = plot(*args)
+    png = encode_png(png, profile)
+    return cid, png, time.perf_counter() - w0, time.thread_time() - c0, peak_rss_mb()
+
+
+def make_chart_pool(workers: int = 0) -> Optional[ProcessPoolExecutor]:
+    """Pool de process pour le rendu matplotlib (Agg est mono-thread et CPU-bound).
+
+    workers=0 : un process par cœur ; workers=1 : pas de pool, rendu dans le process courant.
+    Les process partent d'un serveur forkserver (spawn à défaut) et non d'un
+    fork du process courant : l'appelant peut déjà faire tourner des threads
+    (envoi SMTP, appels Einstein), dont les verrous seraient copiés pris.
+    Ils sont démarrés tout de suite, avant que les rapports n'arrivent.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                               initializer=_mpl_setup)
+    pool.submit(_mpl_setup).result()
+    return pool
+
+
+def render_charts(D: dict, pool: Optional[ProcessPoolExecutor] = None,
+                  timer: Optional[StageTimer] = None, profile_path: Optional[Path] = None,
+                  image_profile: str = "retina") -> dict:
+    """PNG des graphiques d'un rapport dans un profil d'image (IMAGE_PROFILES), {Content-ID: bytes}.
+
+    Avec un pool, les 5 graphiques partent en parallèle (et ceux des autres
+    rapports du batch s'intercalent dans le même pool). Avec profile_path,
+    le rendu se fait dans le process courant sous cProfile et les stats sont
+    écrites dans ce fichier (lecture : python -m pstats FICHIER).
+    """
+    timer = timer or StageTimer()
+    jobs = [(*job, image_profile) for job in chart_jobs(D)]
+    with timer.stage("charts"):
+        if profile_path:
+            profiler = cProfile.Profile()
+            with _RENDER_LOCK:
+                results = profiler.runcall(lambda: list(map(_render_job, jobs)))
+            profiler.create_stats()   # = dump_stats, écrit d'un bloc
+            write_atomic(profile_path, marshal.dumps(profiler.stats))
+        elif pool is None:
+            with _RENDER_LOCK:
+                results = list(map(_render_job, jobs))
+        else:
+            results = list(pool.map(_render_job, jobs))
+
+    for cid, _, wall_s, cpu_s, peak_mb in results:
+        timer.add(f"chart:{cid}", wall_s, cpu_s, peak_mb)
+    return {cid: png for cid, png, *_ in results}
+
+
+def build_report_eml(D: dict, from_addr: str, to_addr: str, subject: str = "",
+                     chart_pool: Optional[ProcessPoolExecutor] = None,
+                     timer: Optional[StageTimer] = None, profile_path: Optional[Path] = None,
+                     attachments: Optional[List[Tuple[str, bytes]]] = None,
+                     image_profile: str = "retina", max_mail_kb: int = 0,
+                     sizes: Optional[dict] = None) -> bytes:
+    """Rend les graphiques d'un rapport et assemble le message .eml.
+
+    Avec max_mail_kb, un mail plus gros que ce budget, pièces jointes non
+    comprises (le xlsx ne dépend pas du profil), est reconstruit avec les
+    profils d'image suivants (IMAGE_PROFILES, du plus lourd au plus léger)
+    jusqu'à passer sous le budget ; le profil le plus léger est gardé sinon.
+    sizes (dict) reçoit la taille du mail final par famille (cf. mime_sizes).
+    """
+    timer = timer or StageTimer()
+
+    if not subject:
+        camp = D.get("meta", {}).get("camping_name", "Camping Sunêlia")
+        date_obs = D.get("meta", {}).get("date_observation", "")
+        subject = f"Reporting Sunêlia — {camp} — {date_obs}"
+
+    profiles = list(IMAGE_PROFILES)
+    profiles = profiles[profiles.index(image_profile):] if max_mail_kb else [image_profile]
+    sizes = sizes if sizes is not None else {}
+    for n, profile in enumerate(profiles):
+        images = render_charts(D, chart_pool, timer=timer, profile_path=profile_path, image_profile=profile)
+        eml_bytes = build_eml_message(D, from_addr=from_addr, to_addr=to_addr, subject=subject, images=images,
+                                      timer=timer, attachments=attachments, sizes=sizes)
+        mail_bytes = sizes["total"] - sizes["attachments"]
+        if not max_mail_kb or mail_bytes <= max_mail_kb * 1024:
+            break
+        fallback = f"→ profil {profiles[n + 1]}" if n + 1 < len(profiles) else "(profil le plus léger, gardé)"
+        print(f"        ⚠ Mail de {mail_bytes / 1024:.0f} Ko hors pièces jointes > budget {max_mail_kb} Ko "
+              f"en profil {profile} {fallback}")
+    return eml_bytes
+
+
+class ReportResult:
+    """Fichiers écrits pour un rapport : chemins exacts, None tant que le fichier n'est pas écrit.
+
+    Tous sont nommés d'après le classeur (Reporting_<nom>.*, cf. report_name) :
+    des rapports générés en même temps dans un même dossier ne se marchent
+    pas dessus, et chaque fichier est écrit d'un bloc (write_atomic).
+      eml     : .eml             mail (absent en dry-run)
+      data    : .json            données du rapport (lues par le rollup groupe)
+      prompt  : .prompt.txt      prompt (dry-run)
+      raw     : .ai_raw.txt      réponse Einstein brute
+      timings : .timings.json    temps par étape
+      profile : .charts.prof     profil cProfile du rendu des graphiques
+    attachments : noms des fichiers joints au .eml (le xlsx source avec attach_excel).
+    """
+
+    SUFFIXES = {"eml": ".eml", "data": ".json", "prompt": ".prompt.txt", "raw": ".ai_raw.txt",
+                "timings": ".timings.json", "profile": ".charts.prof"}
+
+    def __init__(self, excel_path, output_dir: Path):
+        self.excel = excel_path
+        self.output_dir = Path(output_dir)
+        self.name = report_name(excel_path)
+        for kind in self.SUFFIXES:
+            setattr(self, kind, None)
+        self.attachments = []
+
+    def path(self, kind: str) -> Path:
+        return self.output_dir / f"Reporting_{self.name}{self.SUFFIXES[kind]}"
+
+    def write(self, kind: str, data) -> Path:
+        setattr(self, kind, write_atomic(self.path(kind), data))
+        return getattr(self, kind)
+
+    def files(self) -> dict:
+        """{type: chemin} des fichiers écrits."""
+        return {kind: getattr(self, kind) for kind in self.SUFFIXES if getattr(self, kind) is not None}
+
+
+def report_name(excel_path) -> str:
+    """Nom des fichiers d'un rapport : nom du classeur sans extension ni préfixe d'export CRM."""
+    return Path(excel_path.name).stem.replace("Sunelia_Rapports_indiv_pour_groupe_", "")
+
+
+def generate_one(
+    excel_path,
+    output_dir: Path,
+    token: str = "",
+    instance_url: str = "",
+    from_addr: str = "reporting@sunelia.local",
+    to_addr: str = "destinataire@exemple.com",
+    subject: str = "",
+    dry_run: bool = False,
+    limiter: Optional[EinsteinLimiter] = None,
+    cache: Optional[EinsteinCache] = None,
+    refresh: bool = False,
+    engine: str = "openpyxl",
+    rules: bool = True,
+    chart_pool: Optional[ProcessPoolExecutor] = None,
+    timer: Optional[StageTimer] = None,
+    profile: bool = False,
+    attach_excel: bool = False,
+    auth: Optional[SfAuth] = None,
+    client: Optional[EinsteinClient] = None,
+    image_profile: str = "retina",
+    max_mail_kb: int = 0,
+    result: Optional[ReportResult] = None,
+) -> ReportResult:
+    """Génère le .eml d'un fichier Excel ; retourne les chemins des fichiers écrits (ReportResult).
+
+    Avec rules=True, les indicateurs chiffrés sont lus directement dans le
+    classeur (extract_structured) et l'IA ne rédige que les insights ; si une
+    section n'est pas reconnue, le prompt complet historique est utilisé.
+
+    Tous les fichiers du rapport sont nommés d'après le classeur
+    (Reporting_<nom>.eml, .json, .timings.json... cf. ReportResult) et écrits
+    d'un bloc : plusieurs générations peuvent partager output_dir. `result`
+    (sinon créé ici) est rempli au fur et à mesure, pour que l'appelant
+    connaisse aussi les fichiers déjà écrits quand la génération échoue.
+
+    Avec profile=True, le rendu des graphiques est profilé (cProfile) dans
+    Reporting_<nom>.charts.prof. Avec attach_excel=True, le xlsx source est
+    joint au .eml, qui peut alors être envoyé tel quel.
+
+    excel_path peut être un membre de zip (zipfile.Path, cf. zip_workbooks) :
+    il est lu une seule fois en mémoire, pour l'extraction et la pièce jointe.
+    Avec `auth` (SfAuth), token/instance_url sont ignorés : le token n'est
+    demandé qu'en cas d'appel Einstein effectif.
+    image_profile / max_mail_kb : profil des images et budget de taille du
+    mail (cf. build_report_eml) ; la taille finale est affichée par famille.
+
+    Lève une exception en cas d'échec (auth, API, JSON invalide...).
+    """
+    excel_path = excel_path if isinstance(excel_path, zipfile.Path) else Path(excel_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    timer = timer if timer is not None else StageTimer()
+    result = result if result is not None else ReportResult(excel_path, output_dir)
+
+    # 1) Extraction
+    print("  [1/4] Extraction des données Excel...")
+    with timer.stage("extract"):
+        data = excel_path.read_bytes() if attach_excel or isinstance(excel_path, zipfile.Path) else None
+        sheets = load_sheets(BytesIO(data) if data is not None else str(excel_path), engine=engine)
+        data_text = sheets_to_prompt_text(sheets)
+        figures, missing = extract_structured(sheets) if rules else ({}, [])
+    print(f"        ✓ {len(data_text) / 1024:.1f} Ko de données extraites")
+
+    if rules and missing:
+        print(f"        ⚠ Lecture directe incomplète ({', '.join(missing)}) → analyse IA complète")
+    elif rules:
+        print("        ✓ Indicateurs chiffrés lus sans IA")
+
+    # 2) Prompt
+    print("  [2/4] Construction du prompt...")
+    insights_only = rules and not missing
+    with timer.stage("prompt"):
+        prompt = build_insights_prompt(figures) if insights_only else build_prompt(data_text)
+    required_key = "insights" if insights_only else "meta"
+    print(f"        ✓ Prompt: {len(prompt)} chars (~{estimate_tokens(prompt)} tokens)")
+
+    if dry_run:
+        result.write("prompt", prompt)
+        print(f"\n  [DRY RUN] Prompt sauvegardé: {result.prompt}")
+        return result
+
+    # 3) IA (ou cache)
+    json_str = None
+    if cache and not refresh:
+        with timer.stage("cache"):
+            json_str = cache.get(prompt)
+    if json_str:
+        print("  [3/4] Réponse IA trouvée en cache (appel Einstein évité)")
+    else:
+        print("  [3/4] Appel IA en cours...")
+        with timer.stage("llm"):
+            raw_response = call_einstein(prompt, token, instance_url, limiter=limiter, auth=auth, client=client)
+        elapsed = timer.stages["llm"]["wall_s"]
+        print(f"        ✓ Réponse reçue en {elapsed:.1f}s ({len(raw_response)} chars)")
+
+        result.write("raw", raw_response)
+
+    # 4) JSON + EML
+    print("  [4/4] Génération du mail .eml (HTML + images inline)...")
+    with timer.stage("json"):
+        if not json_str:
+            try:
+                json_str = clean_json(raw_response, required_key)
+            except ValueError:
+                print(f"  ❌ JSON invalide. Réponse brute sauvegardée: {result.raw}")
+                raise
+            if cache:
+                cache.put(prompt, json_str)
+
+        if insights_only:
+            json_str = json.dumps({**figures, "insights": json.loads(json_str)["insights"]}, ensure_ascii=False)
+        D = json.loads(json_str)
+
+    result.write("data", json_str)
+    print(f"        ✓ JSON nettoyé sauvegardé: {result.data.name}")
+
+    print(f"        ✓ JSON valide ({len(D.get('montee_charge',[]))} points montée en charge)")
+    print(f"        ✓ Camping: {D.get('meta',{}).get('camping_name','?')}")
+
+    profile_path = result.path("profile") if profile else None
+    attachments = [(excel_path.name, data)] if attach_excel else None
+    sizes = {}
+    eml_bytes = build_report_eml(D, from_addr, to_addr, subject, chart_pool=chart_pool,
+                                 timer=timer, profile_path=profile_path, attachments=attachments,
+                                 image_profile=image_profile, max_mail_kb=max_mail_kb, sizes=sizes)
+    if profile_path:
+        result.profile = profile_path
+        print(f"        ✓ Profil du rendu des graphiques: {profile_path.name}")
+    print(f"        ✓ Mail: {sizes['total'] / 1024:.0f} Ko (images {sizes['images'] / 1024:.0f} Ko, "
+          f"HTML {sizes['html'] / 1024:.0f} Ko, pièces jointes {sizes['attachments'] / 1024:.0f} Ko)")
+
+    result.write("eml", eml_bytes)
+    result.attachments = [filename for filename, _ in attachments or []]
+    result.timings = timer.write(result.path("timings"))
+    return result
+
+
+def generate_many(
+    paths: list,
+    output_dir: Optional[Path] = None,
+    org: str = "PROD",
+    from_addr: str = "reporting@sunelia.local",
+    to_addr: str = "destinataire@exemple.com",
+    subject: str = "",
+    dry_run: bool = False,
+    workers: int = 1,
+    cache: Optional[EinsteinCache] = None,
+    refresh: bool = False,
+    engine: str = "openpyxl",
+    rules: bool = True,
+    render_workers: int = 0,
+    timer: Optional[StageTimer] = None,
+    profile: bool = False,
+    on_result: Optional[Callable[[dict], None]] = None,
+    attach_excel: bool = False,
+    auth: Optional[SfAuth] = None,
+    client: Optional[EinsteinClient] = None,
+    image_profile: str = "retina",
+    max_mail_kb: int = 0,
+) -> List[dict]:
+    """Génère les .eml de plusieurs fichiers Excel (chemins ou membres de zip) dans un seul process.
+
+    Les modules sont chargés une seule fois ; le token Salesforce (SfAuth,
+    `auth` ou à défaut un SfAuth(org)) est obtenu au premier appel Einstein
+    et partagé par tous les rapports, comme les connexions HTTP (`client`,
+    à défaut un EinsteinClient de `workers` connexions).
+    Avec workers > 1, jusqu'à `workers` appels Einstein sont en vol en même
+    temps (limite réduite automatiquement sur 429/503).
+    Avec un cache, les prompts déjà vus ne repassent pas par Einstein
+    (refresh=True force l'appel et remplace l'entrée).
+    Les graphiques de tous les rapports partagent un pool de `render_workers`
+    process (0 = un par cœur, 1 = rendu dans le process courant).
+    Un échec sur un fichier n'interrompt pas les suivants. Deux classeurs
+    qui donneraient les mêmes fichiers (même nom, même dossier de sortie,
+    cf. report_name) sont refusés avant de commencer (ValueError).
+    image_profile / max_mail_kb s'appliquent à chaque mail (cf. build_report_eml).
+
+    Les étapes communes au batch (auth) sont chronométrées dans `timer`.
+    on_result(entry) est appelé depuis le thread de génération dès qu'un
+    rapport est terminé (succès ou erreur), pour l'envoyer sans attendre le
+    reste du batch ; il peut bloquer (file bornée) mais ne doit pas lever.
+
+    Retourne le registre de la génération, dans l'ordre de `paths` :
+    [{"excel": Path | zipfile.Path, "eml": Path | None, "error": str | None, "elapsed": float,
+      "mail_bytes": int | None, "files": {type: Path} (ReportResult.files, aussi en cas d'erreur),
+      "attachments": [nom du fichier joint au .eml, ...],
+      "timings": {étape: {"wall_s", "cpu_s", "peak_mb"}}}, ...]
+    Il est aussi écrit dans output_dir/generation_ledger.json si output_dir est fourni.
+    """
+    timer = timer if timer is not None else StageTimer()
+    if auth is None and not dry_run:
+        auth = SfAuth(org, timer=timer)
+
+    limiter = EinsteinLimiter(workers)
+
+    def run(n: int, excel_path, report_dir: Path) -> dict:
+        print(f"\n  ── [{n}/{len(paths)}] {excel_path.name}")
+        t0 = time.time()
+        report_timer = StageTimer()
+        result = ReportResult(excel_path, report_dir)
+        entry = {"excel": excel_path, "eml": None, "error": None, "elapsed": 0.0, "mail_bytes": None,
+                 "files": {}, "attachments": [], "timings": report_timer.stages}
+        try:
+            generate_one(
+                excel_path,
+                report_dir,
+                from_addr=from_addr,
+                to_addr=to_addr,
+                subject=subject,
+                dry_run=dry_run,
+                limiter=limiter,
+                cache=cache,
+                refresh=refresh,
+                engine=engine,
+                rules=rules,
+                chart_pool=chart_pool,
+                timer=report_timer,
+                profile=profile,
+                attach_excel=attach_excel,
+                auth=auth,
+                client=client,
+                image_profile=image_profile,
+                max_mail_kb=max_mail_kb,
+                result=result,
+            )
+            if result.eml:
+                entry["eml"] = result.eml
+                entry["mail_bytes"] = result.eml.stat().st_size
+                entry["attachments"] = result.attachments
+                print(f"        ✓ EML: {result.eml.name}")
+        except Exception as e:
+            print(f"  ❌ ERREUR {excel_path.name}: {e}")
+            entry["error"] = str(e)
+        entry["files"] = result.files()
+        entry["elapsed"] = round(time.time() - t0, 2)
+        if on_result:
+            on_result(entry)
+        return entry
+
+    paths = [p if isinstance(p, zipfile.Path) else Path(p) for p in paths]
+    report_dirs = [Path(output_dir) if output_dir else source_dir(p) for p in paths]
+    claimed = {}
+    for excel_path, report_dir in zip(paths, report_dirs):
+        key = (report_dir, report_name(excel_path))
+        if key in claimed:
+            raise ValueError(f"{claimed[key].name} et {excel_path.name} donneraient les mêmes fichiers "
+                             f"Reporting_{key[1]}.* dans {report_dir}")
+        claimed[key] = excel_path
+
+    chart_pool = None if dry_run else make_chart_pool(render_workers)
+    own_client = client is None and not dry_run
+    if own_client:
+        client = EinsteinClient(pool_size=max(1, workers))
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            ledger = list(pool.map(run, range(1, len(paths) + 1), paths, report_dirs))
+    finally:
+        if chart_pool:
+            chart_pool.shutdown()
+        if own_client:
+            client.close()
+
+    if output_dir:
+        write_atomic(Path(output_dir) / "generation_ledger.json", json.dumps(
+            [{**e, "excel": str(e["excel"]), "eml": str(e["eml"]) if e["eml"] else None,
+              "files": {kind: str(path) for kind, path in e["files"].items()}} for e in ledger],
+            ensure_ascii=False, indent=2
+        ))
+
+    return ledger
+
+
+# ═══════════════════════════════════════════════════════
+# 8. ROLLUP GROUPE (un mail réseau à partir des rapports d'un run)
+# ═══════════════════════════════════════════════════════
+
+ROLLUP_PREFIX = "Reporting_groupe"
+
+# kpi_fermes repris dans la table du run ; <kpi>_var = var_pct (delta_pts pour le taux d'occupation)
+ROLLUP_KPIS = ("ca", "sejours", "nuits", "prix_moyen_nuit", "taux_occupation", "revpar")
+
+
+def _dig(D, *keys):
+    for key in keys:
+        D = D.get(key) if isinstance(D, dict) else None
+    return D
+
+
+def _round_num(v, decimals: int = 2) -> Optional[float]:
+    """Nombre arrondi pour le JSON du groupe (None si absent, NaN ou infini)."""
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return round(f, decimals) if math.isfinite(f) else None
+
+
+def _var_pct(n, n1) -> Optional[float]:
+    return _round_num((n / n1 - 1) * 100) if n1 else None
+
+
+def _rows(reports: List[dict], key: str, columns: Tuple[str, ...]) -> pd.DataFrame:
+    """Lignes de la série `key` de tous les rapports (montee_charge, bassins...), colonnes numériques converties."""
+    rows = [row for D in reports for row in (D.get(key) or []) if isinstance(row, dict)]
+    df = pd.DataFrame.from_records(rows)
+    for col in columns:
+        df[col] = pd.to_numeric(df[col], errors="coerce") if col in df else np.nan
+    return df
+
+
+def load_run_reports(run_dir) -> List[dict]:
+    """Rapports camping (Reporting_<nom>.json) d'un run, dans l'ordre de son generation_ledger.json.
+
+    Seuls les rapports dont le mail a été généré sont repris. Sans registre
+    dans le dossier, tous ses Reporting_*.json (hors mail groupe et hors
+    autres fichiers .json d'un rapport, comme Reporting_<nom>.timings.json).
+    """
+    run_dir = Path(run_dir)
+    ledger_path = run_dir / "generation_ledger.json"
+    if ledger_path.exists():
+        ledger = json.loads(ledger_path.read_text(encoding="utf-8"))
+        # registre d'avant ReportResult (sans "files") : le .json est à côté du .eml
+        paths = [run_dir / Path((e.get("files") or {}).get("data") or Path(e["eml"]).with_suffix(".json")).name
+                 for e in ledger if e.get("eml")]
+    else:
+        others = tuple(suffix for kind, suffix in ReportResult.SUFFIXES.items()
+                       if kind != "data" and suffix.endswith(ReportResult.SUFFIXES["data"]))
+        paths = sorted(p for p in run_dir.glob(f"Reporting_*{ReportResult.SUFFIXES['data']}")
+                       if not p.name.startswith(ROLLUP_PREFIX) and not p.name.endswith(others))
+    return [json.loads(p.read_text(encoding="utf-8")) for p in paths if p.exists()]
+
+
+def rollup_frame(reports: List[dict]) -> pd.DataFrame:
+    """Table en colonnes du run : une ligne par camping.
+
+    Colonnes : camping, <kpi>_n / _n1 / _var (ROLLUP_KPIS), total_ca(_var),
+    total_sejours(_var), stock, <location|emplacement>_ca / _var / _sejours / _pmn,
+    bm_<ca|sejours>_<camping|region|reseau>. Valeur absente ou non numérique : NaN.
+    """
+    cols = {}
+    for key in ROLLUP_KPIS:
+        var = "delta_pts" if key == "taux_occupation" else "var_pct"
+        for suffix, field in (("n", "n"), ("n1", "n1"), ("var", var)):
+            cols[f"{key}_{suffix}"] = [_dig(D, "kpi_fermes", key, field) for D in reports]
+    for key in ("ca", "sejours"):
+        cols[f"total_{key}"] = [_dig(D, "kpi_total", key, "n") for D in reports]
+        cols[f"total_{key}_var"] = [_dig(D, "kpi_total", key, "var_pct") for D in reports]
+    cols["stock"] = [_dig(D, "kpi_total", "stock") for D in reports]
+    for product in ("location", "emplacement"):
+        for suffix, field in (("ca", "ca"), ("var", "var_pct"), ("sejours", "sejours_n"), ("pmn", "pmn")):
+            cols[f"{product}_{suffix}"] = [_dig(D, "produits", product, field) for D in reports]
+    for key in ("ca", "sejours"):
+        for ref in ("camping", "region", "reseau"):
+            cols[f"bm_{key}_{ref}"] = [_dig(D, "benchmark", key, ref) for D in reports]
+
+    df = pd.DataFrame({k: pd.to_numeric(pd.Series(v, dtype=object), errors="coerce").astype(float)
+                       for k, v in cols.items()})
+    df.insert(0, "camping", [str(_dig(D, "meta", "camping_name") or "?") for D in reports])
+    return df
+
+
+def group_report_data(reports: List[dict], df: Optional[pd.DataFrame] = None) -> dict:
+    """Rapport du groupe, au format d'un rapport camping (mêmes clés que Reporting_<nom>.json).
+
+    Variations recalculées sur les sommes N / N-1 (N-1 déduit de la variation
+    quand le rapport ne le donne pas) ; taux d'occupation et RevPAR rapportés
+    aux nuitées disponibles (nuitées / taux) ; séries sommées par date,
+    semaine, période et bassin. Benchmark : groupe / médiane des campings /
+    réseau. Les insights (classements, distributions) sont calculés, sans IA.
+    """
+    df = rollup_frame(reports) if df is None else df
+    n = len(df)
+    meta = reports[0].get("meta", {}) if reports else {}
+
+    # ── kpi_fermes
+    sums = df[["ca_n", "ca_n1", "sejours_n", "sejours_n1", "nuits_n", "nuits_n1"]].sum()
+
+    def occupation(suffix: str) -> Tuple[Optional[float], Optional[float]]:
+        taux, nuits, ca = df[f"taux_occupation_{suffix}"], df[f"nuits_{suffix}"], df[f"ca_{suffix}"]
+        ok = (taux > 0) & nuits.notna()
+        dispo = (nuits[ok] / taux[ok] * 100).sum()
+        return (nuits[ok].sum() / dispo * 100, ca[ok].sum() / dispo) if dispo else (None, None)
+
+    to_n, revpar_n = occupation("n")
+    to_n1, revpar_n1 = occupation("n1")
+    pmn_n = sums["ca_n"] / sums["nuits_n"] if sums["nuits_n"] else None
+    pmn_n1 = sums["ca_n1"] / sums["nuits_n1"] if sums["nuits_n1"] else None
+    kpi_fermes = {
+        key: {"n": _round_num(sums[f"{key}_n"]), "n1": _round_num(sums[f"{key}_n1"]),
+              "var_pct": _var_pct(sums[f"{key}_n"], sums[f"{key}_n1"])}
+        for key in ("ca", "sejours", "nuits")
+    }
+    kpi_fermes["prix_moyen_nuit"] = {"n": _round_num(pmn_n), "n1": _round_num(pmn_n1), "var_pct": _var_pct(pmn_n, pmn_n1)}
+    kpi_fermes["taux_occupation"] = {"n": _round_num(to_n), "n1": _round_num(to_n1),
+                                     "delta_pts": _round_num(to_n - to_n1) if to_n is not None and to_n1 is not None else None}
+    kpi_fermes["revpar"] = {"n": _round_num(revpar_n), "n1": _round_num(revpar_n1), "var_pct": _var_pct(revpar_n, revpar_n1)}
+
+    # ── kpi_total (N-1 déduit de la variation)
+    kpi_total = {"stock": int(df["stock"].sum())}
+    for key in ("ca", "sejours"):
+        total, var = df[f"total_{key}"], df[f"total_{key}_var"]
+        ok = total.notna() & var.notna() & (var > -100)
+        kpi_total[key] = {"n": _round_num(total.sum()),
+                          "var_pct": _var_pct(total[ok].sum(), (total[ok] / (1 + var[ok] / 100)).sum())}
+
+    # ── produits : PMN = CA / nuitées, nuitées = CA / PMN
+    produits = {}
+    for product in ("location", "emplacement"):
+        ca, var, pmn = df[f"{product}_ca"], df[f"{product}_var"], df[f"{product}_pmn"]
+        ok = ca.notna() & var.notna() & (var > -100)
+        nights = (ca / pmn.where(pmn > 0)).sum()
+        produits[product] = {"ca": _round_num(ca.sum()),
+                             "var_pct": _var_pct(ca[ok].sum(), (ca[ok] / (1 + var[ok] / 100)).sum()),
+                             "sejours_n": _round_num(df[f"{product}_sejours"].sum(), 0),
+                             "pmn": _round_num(ca[pmn > 0].sum() / nights) if nights else None}
+    produits["total_ca"] = _round_num(df["location_ca"].sum() + df["emplacement_ca"].sum())
+
+    # ── séries
+    mc = _rows(reports, "montee_charge", ("n", "n1"))
+    montee_charge = [{"date": date, "n": _round_num(r.n), "n1": _round_num(r.n1)}
+                     for date, r in mc.groupby("date", sort=False)[["n", "n1"]].sum().iterrows()] if "date" in mc else []
+    wk = _rows(reports, "ventes_semaine", ("n", "n1"))
+    ventes_semaine = [{"sem": sem, "n": _round_num(r.n), "n1": _round_num(r.n1)}
+                      for sem, r in wk.groupby("sem", sort=False)[["n", "n1"]].sum().iterrows()] if "sem" in wk else []
+
+    saisonnalite = []
+    ss = _rows(reports, "saisonnalite", ("ca_n", "ca_n1", "sejours", "taux_occ"))
+    if "periode" in ss:
+        ss["occ_x_sej"] = ss["taux_occ"] * ss["sejours"]   # taux moyen pondéré par les séjours
+        ss["is_haute"] = ss["is_haute"].fillna(False).astype(bool) if "is_haute" in ss else False
+        agg = ss.groupby("periode", sort=False).agg(ca_n=("ca_n", "sum"), ca_n1=("ca_n1", "sum"), sejours=("sejours", "sum"),
+                                                     occ_x_sej=("occ_x_sej", "sum"), is_haute=("is_haute", "any"))
+        saisonnalite = [{"periode": periode, "ca_n": _round_num(r.ca_n), "ca_n1": _round_num(r.ca_n1), "var_pct": _var_pct(r.ca_n, r.ca_n1),
+                         "sejours": _round_num(r.sejours, 0), "taux_occ": _round_num(r.occ_x_sej / r.sejours, 1) if r.sejours else None,
+                         "is_haute": bool(r.is_haute)}
+                        for periode, r in agg.iterrows()]
+
+    bassins = []
+    bs = _rows(reports, "bassins", ("ca", "var_pct"))
+    if "region" in bs:
+        bs["ca_n1"] = bs["ca"] / (1 + bs["var_pct"].where(bs["var_pct"] > -100) / 100)
+        agg = bs.groupby("region", sort=False)[["ca", "ca_n1"]].sum().sort_values("ca", ascending=False)
+        total = agg["ca"].sum()
+        bassins = [{"region": region, "ca": _round_num(r.ca, 0), "pct_total": _round_num(r.ca / total * 100, 1) if total else None,
+                    "var_pct": _var_pct(r.ca, r.ca_n1)}
+                   for region, r in agg.iterrows()]
+
+    # ── benchmark : groupe / médiane des campings / réseau
+    benchmark = {
+        "ca": {"camping": kpi_fermes["ca"]["var_pct"], "region": _round_num(df["ca_var"].median()),
+               "reseau": _round_num(df["bm_ca_reseau"].median())},
+        "sejours": {"camping": kpi_fermes["sejours"]["var_pct"], "region": _round_num(df["sejours_var"].median()),
+                    "reseau": _round_num(df["bm_sejours_reseau"].median())},
+        "region_label": "Médiane des campings",
+        "region_nb": n,
+        "reseau_label": next((D["benchmark"]["reseau_label"] for D in reports if _dig(D, "benchmark", "reseau_label")), "Réseau"),
+        "reseau_nb": next((D["benchmark"]["reseau_nb"] for D in reports if _dig(D, "benchmark", "reseau_nb")), ""),
+    }
+
+    return {
+        "meta": {"camping_name": f"Groupe Sunêlia ({n} campings)",
+                 "date_observation": meta.get("date_observation", ""),
+                 "date_comparaison": meta.get("date_comparaison", "")},
+        "kpi_fermes": kpi_fermes,
+        "kpi_total": kpi_total,
+        "benchmark": benchmark,
+        "montee_charge": montee_charge,
+        "ventes_semaine": ventes_semaine,
+        "produits": produits,
+        "saisonnalite": saisonnalite,
+        "bassins": bassins,
+        "insights": rollup_insights(df, kpi_fermes, benchmark),
+    }
+
+
+def rollup_insights(df: pd.DataFrame, kpi_fermes: dict, benchmark: dict) -> List[dict]:
+    """Six insights de classement et de distribution, calculés sur la table du run."""
+    n = len(df)
+
+    def short(name: str) -> str:
+        return name.replace("Camping Sunêlia ", "")
+
+    def ranking(rows: pd.DataFrame) -> str:
+        return ", ".join(f"{short(c)} ({fmt_pct(v)})" for c, v in zip(rows["camping"], rows["ca_var"])) or "-"
+
+    ranked = df.dropna(subset=["ca_var"]).sort_values("ca_var", ascending=False)
+    ca_q = df["ca_var"].quantile([0.25, 0.5, 0.75])
+    occ_q = df["taux_occupation_n"].quantile([0.25, 0.5, 0.75])
+    above_ca = int((df["ca_var"] > df["bm_ca_reseau"]).sum())
+    above_sj = int((df["sejours_var"] > df["bm_sejours_reseau"]).sum())
+    down = int((df["ca_var"] < 0).sum())
+    occ = kpi_fermes["taux_occupation"]
+
+    return [
+        {"type": "positive", "title": "Meilleures progressions du CA", "text": ranking(ranked.head(3))},
+        {"type": "alert" if down else "warning", "title": "Plus faibles progressions du CA",
+         "text": ranking(ranked.tail(3).iloc[::-1])},
+        {"type": "info", "title": "Distribution de la variation du CA",
+         "text": f"Médiane {fmt_pct(ca_q[0.5])}, quartiles {fmt_pct(ca_q[0.25])} à {fmt_pct(ca_q[0.75])} ; "
+                 f"{down} camping(s) sur {n} en recul."},
+        {"type": "info", "title": "Taux d'occupation",
+         "text": f"Groupe {fmt_fr(occ['n'], 1)} % ({fmt_pts(occ['delta_pts'])} vs N-1) ; médiane des campings "
+                 f"{fmt_fr(occ_q[0.5], 1)} %, quartiles {fmt_fr(occ_q[0.25], 1)} à {fmt_fr(occ_q[0.75], 1)} %."},
+        {"type": "positive" if 2 * above_ca >= n else "warning", "title": "Benchmark réseau — CA",
+         "text": f"{above_ca} camping(s) sur {n} progressent plus vite que le réseau ({fmt_pct(benchmark['ca']['reseau'])})."},
+        {"type": "positive" if 2 * above_sj >= n else "warning", "title": "Benchmark réseau — séjours",
+         "text": f"{above_sj} camping(s) sur {n} progressent plus vite que le réseau ({fmt_pct(benchmark['sejours']['reseau'])})."},
+    ]
+
+
+def ranking_xlsx(df: pd.DataFrame) -> bytes:
+    """Classement complet des campings (table du run triée par variation du CA), en xlsx."""
+    buf = BytesIO()
+    ranked = df.sort_values("ca_var", ascending=False, na_position="last")
+    ranked.insert(0, "rang", range(1, len(ranked) + 1))
+    ranked.to_excel(buf, index=False, sheet_name="Classement")
+    return buf.getvalue()
+
+
+def generate_rollup(
+    reports: List[dict],
+    output_dir: Path,
+    from_addr: str = "reporting@sunelia.local",
+    to_addr: str = "destinataire@exemple.com",
+    subject: str = "",
+    chart_pool: Optional[ProcessPoolExecutor] = None,
+    timer: Optional[StageTimer] = None,
+    image_profile: str = "retina",
+    max_mail_kb: int = 0,
+) -> Path:
+    """Génère le mail du groupe à partir des rapports camping d'un run et retourne son chemin.
+
+    Mêmes graphiques et même HTML qu'un rapport camping ; le classement
+    complet est joint en xlsx et les données agrégées sont écrites à côté
+    du .eml (Reporting_groupe_<date>.json). Aucun appel Einstein.
+    """
+    if not reports:
+        raise ValueError("Aucun rapport camping à agréger")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    timer = timer if timer is not None else StageTimer()
+
+    with timer.stage("rollup"):
+        df = rollup_frame(reports)
+        D = group_report_data(reports, df)
+    print(f"  ✓ {len(df)} rapport(s) agrégé(s) en {timer.stages['rollup']['wall_s'] * 1000:.0f} ms")
+
+    date_obs = D["meta"]["date_observation"]
+    try:
+        stamp = datetime.strptime(date_obs, "%d/%m/%Y").strftime("%Y_%m_%d")
+    except ValueError:
+        stamp = datetime.now().strftime("%Y_%m_%d")
+    with timer.stage("ranking"):
+        attachments = [(f"Classement_campings_{stamp}.xlsx", ranking_xlsx(df))]
+
+    eml_bytes = build_report_eml(D, from_addr, to_addr, subject, chart_pool=chart_pool, timer=timer,
+                                 attachments=attachments, image_profile=image_profile, max_mail_kb=max_mail_kb)
+    write_atomic(output_dir / f"{ROLLUP_PREFIX}_{stamp}.json", json.dumps(D, ensure_ascii=False, indent=2))
+    return write_atomic(output_dir / f"{ROLLUP_PREFIX}_{stamp}.eml", eml_bytes)
+
+
+# ═══════════════════════════════════════════════════════
+# 9. MAIN
 # ═══════════════════════════════════════════════════════
 
 def main():
     parser = argparse.ArgumentParser(description="Génère un reporting email (.eml) Sunêlia via IA — UI thème Sunêlia + benchmark premium")
-    parser.add_argument("excel", help="Chemin vers le fichier Excel (.xlsx)")
+    parser.add_argument("excel", nargs="?", help="Chemin vers le fichier Excel (.xlsx)")
+    parser.add_argument("--batch", default="", help="Dossier ou archive .zip de fichiers .xlsx à traiter en un seul process")
     parser.add_argument("--org", default="PROD", help="Org Salesforce (défaut: PROD)")
     parser.add_argument("--output", default="", help="Dossier de sortie (défaut: même que le fichier)")
     parser.add_argument("--dry-run", action="store_true", help="Sauvegarde le prompt sans appeler l'API")
     parser.add_argument("--from", dest="from_addr", default="reporting@sunelia.local", help="Adresse expéditeur")
     parser.add_argument("--to", dest="to_addr", default="destinataire@exemple.com", help="Adresse destinataire")
     parser.add_argument("--subject", default="", help="Sujet du mail (défaut auto)")
+    parser.add_argument("--workers", type=int, default=1, help="Appels IA simultanés en mode --batch (défaut: 1)")
+    parser.add_argument("--cache-dir", default=".einstein_cache", help="Dossier du cache des réponses IA (défaut: .einstein_cache)")
+    parser.add_argument("--no-cache", action="store_true", help="Désactive le cache des réponses IA")
+    parser.add_argument("--refresh", action="store_true", help="Ignore les réponses en cache et les remplace")
+    parser.add_argument("--extract-engine", choices=EXTRACT_ENGINES, default="openpyxl",
+                        help="Lecture Excel: openpyxl (streaming, défaut) ou pandas (historique)")
+    parser.add_argument("--prompt-stats", action="store_true",
+                        help="Affiche les tokens par feuille avant/après encodage compact, sans appeler l'API")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="Process de rendu des graphiques (défaut: 0 = un par cœur en --batch, "
+                             "rendu dans le process pour un seul fichier ; 1 = sans pool)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile (cProfile) le rendu des graphiques : Reporting_<nom>.charts.prof")
+    parser.add_argument("--attach-excel", action="store_true", help="Joint le fichier Excel source au .eml")
+    parser.add_argument("--image-profile", choices=list(IMAGE_PROFILES), default="retina",
+                        help="Images du mail: retina (PNG d'origine, défaut), standard (120 dpi, 256 couleurs) "
+                             "ou light (80 dpi, 64 couleurs)")
+    parser.add_argument("--max-mail-kb", type=int, default=0,
+                        help="Budget de taille par mail en Ko, pièces jointes non comprises : au-delà, "
+                             "profils d'image plus légers (défaut: 0 = aucun)")
+    parser.add_argument("--rollup", nargs="?", const="", default=None, metavar="DOSSIER",
+                        help="Mail groupe (totaux réseau, classements) : seul avec le dossier d'un run, "
+                             "ou sans valeur avec --batch pour agréger le batch")
+    parser.add_argument("--no-rules", action="store_true",
+                        help="Désactive la lecture directe des indicateurs : tout le JSON est produit par l'IA")
     args = parser.parse_args()
 
-    excel_path = Path(args.excel)
-    if not excel_path.exists():
-        print(f"❌ Fichier introuvable: {excel_path}")
-        sys.exit(1)
-
-    output_dir = Path(args.output) if args.output else excel_path.parent
-    output_dir.mkdir(parents=True, exist_ok=True)
+    if args.rollup and (args.excel or args.batch):
+        parser.error("--rollup DOSSIER s'utilise seul ; avec --batch, --rollup sans valeur")
+    if args.rollup is not None and args.excel:
+        parser.error("--rollup s'utilise avec --batch ou seul avec le dossier d'un run")
+    if not args.rollup and bool(args.excel) == bool(args.batch):
+        parser.error("indiquer soit un fichier Excel, soit --batch DOSSIER")
+
+    def rollup(run_dir: Path, subject: str = "") -> Path:
+        print(f"\n  ── Rollup groupe : {run_dir}")
+        output_file = generate_rollup(
+            load_run_reports(run_dir),
+            Path(args.output) if args.output else run_dir,
+            from_addr=args.from_addr,
+            to_addr=args.to_addr,
+            subject=subject,
+            image_profile=args.image_profile,
+            max_mail_kb=args.max_mail_kb,
+        )
+        print(f"  → {output_file}")
+        return output_file
 
     print()
     print("  ╔══════════════════════════════════════════════════╗")
@@ -1067,122 +3200,136 @@ def main():
     print("  ╚══════════════════════════════════════════════════╝")
     print()
 
-    # 1) Extraction
-    print("  [1/4] Extraction des données Excel...")
-    data_text = extract_excel(str(excel_path))
-    print(f"        ✓ {len(data_text) / 1024:.1f} Ko de données extraites")
+    if args.rollup:
+        check_dependencies(pd, plt)
+        try:
+            rollup(Path(args.rollup), args.subject)
+        except ValueError as e:
+            print(f"❌ {e}: {args.rollup}")
+            sys.exit(1)
+        sys.exit(0)
 
-    # 2) Prompt
-    print("  [2/4] Construction du prompt...")
-    prompt = build_prompt(data_text)
-    print(f"        ✓ Prompt: {len(prompt)} chars (~{len(prompt)//4} tokens)")
+    if args.batch:
+        batch_dir = Path(args.batch)
+        if batch_dir.is_file() and zipfile.is_zipfile(batch_dir):
+            paths = zip_workbooks(batch_dir)
+            batch_dir = batch_dir.parent
+        elif batch_dir.is_dir():
+            paths = sorted(batch_dir.glob("*.xlsx"))
+        else:
+            print(f"❌ Dossier introuvable: {batch_dir}")
+            sys.exit(1)
+        if not paths:
+            print(f"❌ Aucun .xlsx dans {args.batch}")
+            sys.exit(1)
+    else:
+        paths = [Path(args.excel)]
+        if not paths[0].exists():
+            print(f"❌ Fichier introuvable: {paths[0]}")
+            sys.exit(1)
+
+    # Contrôle à froid : un module manquant doit arrêter le script avant le
+    # premier appel Einstein, pas au rendu des graphiques.
+    if args.dry_run or args.prompt_stats:
+        check_dependencies(pd)
+    else:
+        check_dependencies(pd, requests, plt)
 
-    if args.dry_run:
-        debug_path = output_dir / "prompt_debug.txt"
-        debug_path.write_text(prompt, encoding="utf-8")
-        print(f"\n  [DRY RUN] Prompt sauvegardé: {debug_path}")
+    if args.prompt_stats:
+        for path in paths:
+            print(f"\n  ── {path.name}")
+            source = BytesIO(path.read_bytes()) if isinstance(path, zipfile.Path) else str(path)
+            print_prompt_stats(load_sheets(source, engine=args.extract_engine))
         sys.exit(0)
 
-    # 3) IA
-    print("  [3/4] Authentification Salesforce...")
-    token, instance_url = get_sf_auth(args.org)
-    print("        ✓ Token obtenu")
+    # Créé seulement quand des appels Einstein peuvent avoir lieu
+    cache = None if args.no_cache or args.dry_run else EinsteinCache(args.cache_dir)
 
-    print("  [3/4] Appel IA en cours...")
-    t0 = time.time()
-    raw_response = call_einstein(prompt, token, instance_url)
-    elapsed = time.time() - t0
-    print(f"        ✓ Réponse reçue en {elapsed:.1f}s ({len(raw_response)} chars)")
+    if args.batch:
+        try:
+            results = generate_many(
+                paths,
+                output_dir=Path(args.output) if args.output else batch_dir,
+                org=args.org,
+                from_addr=args.from_addr,
+                to_addr=args.to_addr,
+                subject=args.subject,
+                dry_run=args.dry_run,
+                workers=args.workers,
+                cache=cache,
+                refresh=args.refresh,
+                engine=args.extract_engine,
+                rules=not args.no_rules,
+                render_workers=args.render_workers,
+                profile=args.profile,
+                attach_excel=args.attach_excel,
+                image_profile=args.image_profile,
+                max_mail_kb=args.max_mail_kb,
+            )
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        errors = [r for r in results if r["error"]]
+        print()
+        print(f"  → {len(results) - len(errors)}/{len(results)} rapport(s) traité(s)")
+        for r in errors:
+            print(f"  ❌ {r['excel'].name}: {r['error']}")
+        if args.rollup is not None and len(errors) < len(results) and not args.dry_run:
+            rollup(Path(args.output) if args.output else batch_dir)
+        sys.exit(1 if errors else 0)
+
+    excel_path = paths[0]
+    output_dir = Path(args.output) if args.output else excel_path.parent
 
-    debug_raw = output_dir / "ai_response_raw.txt"
-    debug_raw.write_text(raw_response, encoding="utf-8")
+    timer = StageTimer()
+    # Token réutilisé d'une invocation à l'autre (cache disque) : lancer le
+    # script une fois par camping ne relance pas sf à chaque fois.
+    auth = None if args.dry_run else SfAuth(args.org, timer=timer)
 
-    # 4) JSON + EML
-    print("  [4/4] Génération du mail .eml (HTML + images inline)...")
+    # Un seul rapport (5 graphiques) : démarrer des process et y importer
+    # matplotlib coûte plus que le rendu ; pool seulement sur demande.
+    render_workers = min(args.render_workers, len(CHARTS))
+    chart_pool = None if args.dry_run or render_workers <= 1 else make_chart_pool(render_workers)
     try:
-        json_str = clean_json(raw_response)
+        result = generate_one(
+            excel_path,
+            output_dir,
+            from_addr=args.from_addr,
+            to_addr=args.to_addr,
+            subject=args.subject,
+            dry_run=args.dry_run,
+            cache=cache,
+            refresh=args.refresh,
+            engine=args.extract_engine,
+            rules=not args.no_rules,
+            chart_pool=chart_pool,
+            timer=timer,
+            profile=args.profile,
+            attach_excel=args.attach_excel,
+            auth=auth,
+            image_profile=args.image_profile,
+            max_mail_kb=args.max_mail_kb,
+        )
     except ValueError:
-        debug_path = output_dir / "ai_response_debug.txt"
-        debug_path.write_text(raw_response, encoding="utf-8")
-        print(f"  ❌ JSON invalide. Réponse brute sauvegardée: {debug_path}")
         sys.exit(1)
+    finally:
+        if chart_pool:
+            chart_pool.shutdown()
 
-    debug_json = output_dir / "report_data.json"
-    debug_json.write_text(json_str, encoding="utf-8")
-    print(f"        ✓ JSON nettoyé sauvegardé: {debug_json.name}")
-
-    D = json.loads(json_str)
-    print(f"        ✓ JSON valide ({len(D.get('montee_charge',[]))} points montée en charge)")
-    print(f"        ✓ Camping: {D.get('meta',{}).get('camping_name','?')}")
-
-    # Graphiques
-    img_mc = plot_montee_charge(D)
-    img_wk = plot_ventes_semaine(D)
-    img_donut = plot_produits_donut(D)
-
-    # PREMIUM Benchmark speedometers (3 jauges horizontales)
-    bm = D.get("benchmark", {}) or {}
-    camp_name_short = D.get("meta", {}).get("camping_name", "Camping").replace("Camping Sunêlia ", "")
-    region_lbl = f"{bm.get('region_label','Région')} ({bm.get('region_nb','')})".strip()
-    reseau_lbl = f"{bm.get('reseau_label','Réseau')} ({bm.get('reseau_nb','')})".strip()
-
-    ca_vals = bm.get("ca", {}) or {}
-    sj_vals = bm.get("sejours", {}) or {}
-
-    # Couleurs différenciées mais cohérentes avec le thème
-    c_camping = THEME["teal_500"]
-    c_region  = THEME["teal_900"]
-    c_reseau  = THEME["teal_600"]
-
-    img_bm_ca = plot_benchmark_speedometers(
-        "Positionnement — Variation du CA",
-        [
-            (camp_name_short, float(ca_vals.get("camping", 0) or 0), c_camping),
-            (region_lbl,      float(ca_vals.get("region", 0) or 0), c_region),
-            (reseau_lbl,      float(ca_vals.get("reseau", 0) or 0), c_reseau),
-        ],
-        scale_max=None
-    )
-
-    img_bm_sj = plot_benchmark_speedometers(
-        "Positionnement — Variation du nombre de séjours",
-        [
-            (camp_name_short, float(sj_vals.get("camping", 0) or 0), c_camping),
-            (region_lbl,      float(sj_vals.get("region", 0) or 0), c_region),
-            (reseau_lbl,      float(sj_vals.get("reseau", 0) or 0), c_reseau),
-        ],
-        scale_max=None
-    )
-
-    if not args.subject:
-        camp = D.get("meta", {}).get("camping_name", "Camping Sunêlia")
-        date_obs = D.get("meta", {}).get("date_observation", "")
-        args.subject = f"Reporting Sunêlia — {camp} — {date_obs}"
-
-    eml_bytes = build_eml_message(
-        D,
-        from_addr=args.from_addr,
-        to_addr=args.to_addr,
-        subject=args.subject,
-        img_mc=img_mc,
-        img_wk=img_wk,
-        img_donut=img_donut,
-        img_bm_ca=img_bm_ca,
-        img_bm_sj=img_bm_sj
-    )
-
-    base_name = excel_path.stem.replace("Sunelia_Rapports_indiv_pour_groupe_", "")
-    output_file = output_dir / f"Reporting_{base_name}.eml"
-    output_file.write_bytes(eml_bytes)
+    if result.eml is None:
+        sys.exit(0)
 
     print()
     print("  ╔══════════════════════════════════════════════════╗")
     print("  ║   ✓ MAIL .EML GÉNÉRÉ AVEC SUCCÈS                 ║")
     print("  ╚══════════════════════════════════════════════════╝")
-    print(f"  → {output_file}")
+    print(f"  → {result.eml}")
+    for kind, path in result.files().items():
+        if kind != "eml":
+            print(f"     {kind:<8} {path.name}")
     print("  (Ouvre le .eml dans Outlook/Apple Mail/Thunderbird, ou importe-le dans Gmail.)")
     print()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
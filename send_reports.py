@@ -1,29 +1,247 @@
 import smtplib
+import hashlib
 import zipfile
 import glob
 import os
 import time
 import re
-import subprocess
-import sys
+import json
+import queue
+import threading
+from pathlib import Path
+
+import generate_report
 
 DOWNLOAD_DIR = os.path.abspath('./downloads')
+CACHE_DIR = os.path.join(DOWNLOAD_DIR, 'einstein_cache')
+MANIFEST_DIR = os.path.join(DOWNLOAD_DIR, 'manifests')
 EMAIL_FROM = os.environ['SMTP_EMAIL']
 EMAIL_PASSWORD = os.environ['SMTP_PASSWORD']
 EMAIL_TO = os.environ['EMAIL_TO']
 SF_ORG = os.environ.get('SF_ORG', 'PROD')
 
-BATCH_SIZE = 3
-DELAY_SECONDS = 15
+GEN_WORKERS = int(os.environ.get('GEN_WORKERS', '4'))
+# images du mail (retina | standard | light) et budget par mail en Ko hors xlsx joint (0 = aucun),
+# cf. generate_report.IMAGE_PROFILES
+IMAGE_PROFILE = os.environ.get('IMAGE_PROFILE', 'retina')
+MAX_MAIL_KB = int(os.environ.get('MAX_MAIL_KB', '0'))
+
+# SMTP : office365 par defaut ; SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0 pour un smtpd local
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.office365.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') != '0'
+SMTP_CONNECTIONS = int(os.environ.get('SMTP_CONNECTIONS', '1'))
+SMTP_RATE = float(os.environ.get('SMTP_RATE', '0.5'))     # mails/s max (office365 : 30/min par boite)
+SMTP_BURST = int(os.environ.get('SMTP_BURST', '3'))
+SMTP_MAX_ATTEMPTS = 4
+SEND_QUEUE_SIZE = int(os.environ.get('SEND_QUEUE_SIZE', '8'))   # rapports generes en attente d'envoi
 
 
 def smtp_connect():
-    s = smtplib.SMTP('smtp.office365.com', 587)
-    s.starttls()
-    s.login(EMAIL_FROM, EMAIL_PASSWORD)
+    s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=60)
+    if SMTP_STARTTLS:
+        s.starttls()
+    if EMAIL_PASSWORD:
+        s.login(EMAIL_FROM, EMAIL_PASSWORD)
     return s
 
 
+class TokenBucket:
+    """Cadence d'envoi partagee par toutes les connexions.
+
+    Debit initial = max_rate, rafale de `burst` mails. Sur un refus temporaire
+    (4xx) du serveur, le debit est divise par deux et tout le monde attend
+    `pause` secondes ; chaque envoi accepte le remonte doucement vers max_rate.
+    """
+
+    def __init__(self, max_rate: float, burst: int = 1):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def throttled(self, pause: float):
+        with self.lock:
+            self.rate = max(self.max_rate / 32, self.rate / 2)
+            self.tokens = -pause * self.rate   # dette : personne ne repart avant `pause`
+
+
+class SmtpSender:
+    """Une connexion SMTP authentifiee gardee ouverte pour tous les envois.
+
+    Reconnexion automatique si le serveur coupe (421, deconnexion) ; les
+    refus temporaires 4xx sont re-essayes apres ralentissement du bucket.
+    Les 5xx sont definitifs et remontes a l'appelant.
+    """
+
+    def __init__(self, bucket: TokenBucket, connect=smtp_connect):
+        self.bucket = bucket
+        self.connect = connect
+        self.conn = None
+        self.connections = 0
+
+    def send(self, from_addr: str, to_addrs: list, msg_bytes: bytes):
+        for attempt in range(1, SMTP_MAX_ATTEMPTS + 1):
+            self.bucket.acquire()
+            try:
+                if self.conn is None:
+                    self.conn = self.connect()
+                    self.connections += 1
+                self.conn.sendmail(from_addr, to_addrs, msg_bytes)
+                self.bucket.success()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError) as e:
+                error, code = e, 421
+            except smtplib.SMTPRecipientsRefused as e:
+                codes = [c for c, _ in e.recipients.values()]
+                if not all(400 <= c < 500 for c in codes):
+                    raise
+                error, code = e, codes[0]
+            except smtplib.SMTPResponseException as e:
+                if not 400 <= e.smtp_code < 500:
+                    raise
+                error, code = e, e.smtp_code
+
+            if attempt == SMTP_MAX_ATTEMPTS:
+                raise error
+            pause = min(60.0, 2.0 ** attempt)
+            print(f'  SMTP {code} ({error}), essai {attempt}/{SMTP_MAX_ATTEMPTS}, pause {pause:.0f}s')
+            self.bucket.throttled(pause)
+            if code == 421 or isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+                self.close()
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.conn = None
+
+
+def send_all(jobs, build_message, connections: int = 1, bucket: TokenBucket = None, connect=smtp_connect,
+             on_done=None) -> list:
+    """Envoie tous les mails sur `connections` connexions persistantes.
+
+    jobs : liste, ou queue.Queue alimentee pendant l'envoi et terminee par None.
+    build_message(job) -> (from, [to], bytes) ; on_done(job, erreur) apres chaque mail.
+    Retourne [(job, None | str erreur), ...] dans l'ordre d'envoi.
+    """
+    bucket = bucket or TokenBucket(SMTP_RATE, SMTP_BURST)
+    if isinstance(jobs, queue.Queue):
+        todo = jobs
+    else:
+        todo = queue.Queue()
+        for job in jobs:
+            todo.put(job)
+        todo.put(None)
+        connections = min(connections, len(jobs))
+    results, lock = [], threading.Lock()
+    senders = [SmtpSender(bucket, connect) for _ in range(max(1, connections))]
+
+    def worker(sender: SmtpSender):
+        try:
+            while True:
+                job = todo.get()
+                if job is None:
+                    todo.put(None)   # fin de file, pour les autres connexions
+                    return
+                try:
+                    sender.send(*build_message(job))
+                    error = None
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                with lock:
+                    results.append((job, error))
+                if on_done:
+                    on_done(job, error)
+        finally:
+            sender.close()
+
+    threads = [threading.Thread(target=worker, args=(s,)) for s in senders]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(f'  {sum(s.connections for s in senders)} connexion(s) SMTP ouvertes pour {len(results)} mail(s)')
+    return results
+
+
+class RunManifest:
+    """Etat durable d'un run (un fichier JSON-lines par zip), pour reprendre apres un crash.
+
+    Une ligne ajoutee (et fsync) a chaque changement ; l'etat d'un xlsx est sa
+    derniere ligne. Champs : excel, sha256, status (generated, gen_failed,
+    sent, send_failed), eml, attached (xlsx deja joint au .eml), message_id, error, at.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.items = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue   # derniere ligne tronquee par un crash
+                    self.items.setdefault(rec['excel'], {}).update(rec)
+
+    def get(self, excel_path, sha256: str) -> dict:
+        """Etat connu de ce xlsx, si son contenu n'a pas change depuis."""
+        item = self.items.get(os.path.basename(str(excel_path)))
+        return item if item and item.get('sha256') == sha256 else {}
+
+    def update(self, excel_path, **fields):
+        with self.lock:
+            item = self.items.setdefault(os.path.basename(str(excel_path)), {'excel': os.path.basename(str(excel_path))})
+            item.update(fields, at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def count(self, status: str, names=None) -> int:
+        return sum(1 for name, item in self.items.items()
+                   if item.get('status') == status and (names is None or name in names))
+
+
+def file_sha256(path) -> str:
+    """sha256 d'un fichier ou d'un membre de zip (zipfile.Path), lu par blocs."""
+    h = hashlib.sha256()
+    with (path.open('rb') if isinstance(path, zipfile.Path) else open(path, 'rb')) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def message_id(eml_path: str) -> str:
+    """Message-ID d'un .eml (en-tetes seuls)."""
+    from email.parser import BytesHeaderParser
+    with open(eml_path, 'rb') as f:
+        head = f.read(16384)
+    return BytesHeaderParser().parsebytes(head.split(b'\r\n\r\n', 1)[0]).get('Message-ID', '')
+
+
 def find_latest_zip():
     zips = glob.glob(os.path.join(DOWNLOAD_DIR, 'Sunelia_Rapports_indiv_pour_groupe_*.zip'))
     if not zips:
@@ -36,67 +254,71 @@ def find_latest_zip():
     return max(zips, key=date_key)
 
 
-def extract_zip(latest_zip: str) -> str:
-    extract_dir = latest_zip.replace('.zip', '')
-    if not os.path.exists(extract_dir):
-        with zipfile.ZipFile(latest_zip, 'r') as z:
-            z.extractall(extract_dir)
-        print(f'Dezippe dans : {extract_dir}')
-    else:
-        print(f'Deja dezippe : {extract_dir}')
-    return extract_dir
-
-
-def generate_eml(excel_path: str, output_dir: str) -> str:
-    """Appelle generate_report.py et retourne le chemin du .eml genere."""
-    cmd = [
-        sys.executable, 'generate_report.py', excel_path,
-        '--org', SF_ORG,
-        '--output', output_dir,
-        '--from', EMAIL_FROM,
-        '--to', EMAIL_TO,
-    ]
-    print(f'  Generation rapport: {os.path.basename(excel_path)}')
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-
-    if result.returncode != 0:
-        print(f'  STDERR: {result.stderr[-500:]}')
-        raise RuntimeError(f'generate_report.py echoue (code {result.returncode})')
-
-    # Trouver le .eml genere
-    base = os.path.splitext(os.path.basename(excel_path))[0]
-    base_clean = base.replace('Sunelia_Rapports_indiv_pour_groupe_', '')
-    eml_path = os.path.join(output_dir, f'Reporting_{base_clean}.eml')
-
-    if not os.path.exists(eml_path):
-        # fallback: chercher tout .eml recent
-        emls = glob.glob(os.path.join(output_dir, '*.eml'))
-        if emls:
-            eml_path = max(emls, key=os.path.getmtime)
-        else:
-            raise FileNotFoundError(f'Aucun .eml trouve dans {output_dir}')
-
-    print(f'  EML genere: {os.path.basename(eml_path)}')
-    return eml_path
-
+def splice_attachment(raw: bytes, filename: str, data: bytes) -> bytes:
+    """Insere une piece jointe xlsx dans un .eml brut, sans reparser le message.
 
-def send_eml(smtp_conn, eml_path: str, excel_path: str):
-    """Envoie un fichier .eml avec le xlsx en piece jointe."""
+    La partie est celle du generateur (generate_report.attachment_part) : nom
+    de fichier non ASCII ou long encode RFC 2231.
+    """
+    from email.parser import BytesHeaderParser
     from email import policy as epolicy
-    from email.mime.base import MIMEBase
-    from email import encoders
 
-    with open(eml_path, 'rb') as f:
-        msg = email.message_from_bytes(f.read(), policy=epolicy.SMTP)
+    body_at = raw.find(b'\r\n\r\n')
+    boundary = BytesHeaderParser(policy=epolicy.SMTP).parsebytes(raw[:body_at + 4]).get_boundary()
+    if not boundary:
+        raise ValueError('message non multipart : piece jointe impossible')
+    end = raw.rfind(f'--{boundary}--'.encode())
+    if end < 0:
+        raise ValueError('delimiteur de fin multipart absent : .eml tronque ?')
+    part = f'--{boundary}\r\n'.encode() + generate_report.attachment_part(filename, data).as_bytes(policy=epolicy.SMTP)
+    return raw[:end] + part + raw[end:]
+
 
-    with open(excel_path, 'rb') as f:
-        part = MIMEBase('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        part.set_payload(f.read())
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(excel_path))
-        msg.attach(part)
+def build_eml(eml_path: str, excel, attached: bool) -> bytes:
+    """Message pret a envoyer : le .eml tel quel si le xlsx y est deja joint, sinon xlsx greffe.
 
-    smtp_conn.sendmail(EMAIL_FROM, [EMAIL_TO], msg.as_bytes())
+    excel : chemin ou membre de zip (zipfile.Path). attached : le generateur a
+    joint ce xlsx (entry['attachments'] de generate_many, 'attached' du manifeste).
+    """
+    with open(eml_path, 'rb') as f:
+        raw = f.read()
+    if attached:
+        return raw
+    if not isinstance(excel, zipfile.Path):
+        excel = Path(excel)
+    return splice_attachment(raw, excel.name, excel.read_bytes())
+
+
+def summarize_run(results, run_timer, send_s: float) -> dict:
+    """Agrege les timings par etape de tous les rapports (somme, moyenne, max)."""
+    stages = {}
+    for r in results:
+        for name, st in (r.get('timings') or {}).items():
+            agg = stages.setdefault(name, {'reports': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'max_wall_s': 0.0, 'peak_mb': 0.0})
+            agg['reports'] += 1
+            agg['wall_s'] += st['wall_s']
+            agg['cpu_s'] += st['cpu_s']
+            agg['max_wall_s'] = max(agg['max_wall_s'], st['wall_s'])
+            agg['peak_mb'] = max(agg['peak_mb'], st['peak_mb'] or 0.0)
+    for name, st in run_timer.stages.items():
+        stages[name] = {'reports': 0, 'wall_s': st['wall_s'], 'cpu_s': st['cpu_s'],
+                        'max_wall_s': st['wall_s'], 'peak_mb': st['peak_mb'] or 0.0}
+    stages['send'] = {'reports': 0, 'wall_s': send_s, 'cpu_s': 0.0, 'max_wall_s': send_s, 'peak_mb': 0.0}
+
+    print('\nResume du run (temps cumules sur tous les rapports) :')
+    print(f"  {'etape':<20} {'rapports':>8} {'mur s':>9} {'moy s':>8} {'max s':>8} {'CPU s':>9} {'pic Mo':>8}")
+    for name, st in sorted(stages.items(), key=lambda kv: -kv[1]['wall_s']):
+        for k in ('wall_s', 'cpu_s', 'max_wall_s'):
+            st[k] = round(st[k], 3)
+        avg = st['wall_s'] / st['reports'] if st['reports'] else st['wall_s']
+        print(f"  {name:<20} {st['reports']:>8} {st['wall_s']:>9.2f} {avg:>8.2f} {st['max_wall_s']:>8.2f} "
+              f"{st['cpu_s']:>9.2f} {st['peak_mb']:>8.1f}")
+    return {
+        'reports': len(results),
+        'errors': sum(1 for r in results if r['error']),
+        'generation_s': round(sum(r['elapsed'] for r in results), 2),
+        'stages': stages,
+    }
 
 
 def main():
@@ -106,58 +328,113 @@ def main():
         raise SystemExit('Aucun zip trouve')
 
     print(f'Zip le plus recent : {os.path.basename(latest_zip)}')
-    extract_dir = extract_zip(latest_zip)
 
     eml_dir = os.path.join(DOWNLOAD_DIR, 'eml_output')
     os.makedirs(eml_dir, exist_ok=True)
 
-    excels_all = sorted(glob.glob(os.path.join(extract_dir, '*.xlsx')))
+    # Les xlsx sont lus directement dans le zip (pas d'extraction sur disque)
+    excels_all = generate_report.zip_workbooks(latest_zip)
     SKIP = ['Wecamp', 'Baia']
-    excels = [e for e in excels_all if not any(s.lower() in os.path.basename(e).lower() for s in SKIP)]
+    excels = [e for e in excels_all if not any(s.lower() in e.name.lower() for s in SKIP)]
     print(f'Trouve {len(excels_all)} fichiers Excel, {len(excels)} apres filtrage (exclus: {len(excels_all)-len(excels)})')
 
     if not excels:
         raise SystemExit('0 Excel trouve dans le zip')
 
-    # Phase 1 : generation de tous les .eml
-    eml_files = []
-    for excel_path in excels:
+    # Reprise : les xlsx deja envoyes (meme contenu) sont sautes, les .eml deja
+    # generes repartent directement a l'envoi, le reste est (re)genere.
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    manifest = RunManifest(os.path.join(MANIFEST_DIR, os.path.basename(latest_zip).replace('.zip', '.jsonl')))
+    names = {e.name for e in excels}
+    shas = {e.name: file_sha256(e) for e in excels}
+    to_generate, to_send, already_sent = [], [], 0
+    for e in excels:
+        known = manifest.get(e.name, shas[e.name])
+        if known.get('status') == 'sent':
+            already_sent += 1
+        elif known.get('status') in ('generated', 'send_failed') and os.path.exists(known.get('eml') or ''):
+            # manifestes sans 'attached' : .eml generes ici, donc toujours avec le xlsx
+            to_send.append((known['eml'], e, known.get('attached', True)))
+        else:
+            to_generate.append(e)
+    if already_sent or to_send:
+        print(f'Reprise : {already_sent} deja envoye(s), {len(to_send)} a renvoyer, {len(to_generate)} a generer')
+
+    # Generation et envoi en parallele : chaque .eml termine part dans une file
+    # bornee, videe par le(s) connexion(s) SMTP pendant que le reste se genere.
+    ready = queue.Queue(maxsize=SEND_QUEUE_SIZE)
+    run_timer = generate_report.StageTimer()
+    generation = {'results': []}
+
+    def on_generated(r):
+        excel = r['excel']
+        if r['error']:
+            print(f"  ERREUR generation {excel.name}: {r['error']}")
+            manifest.update(excel.name, sha256=shas[excel.name], status='gen_failed', error=r['error'])
+        else:
+            attached = excel.name in r['attachments']
+            manifest.update(excel.name, sha256=shas[excel.name], status='generated', eml=str(r['eml']),
+                            attached=attached, error=None)
+            ready.put((str(r['eml']), excel, attached))
+
+    def produce():
         try:
-            eml_path = generate_eml(excel_path, eml_dir)
-            eml_files.append((eml_path, excel_path))
+            for job in to_send:
+                ready.put(job)
+            if to_generate:
+                generation['results'] = generate_report.generate_many(
+                    to_generate,
+                    output_dir=eml_dir,
+                    org=SF_ORG,
+                    from_addr=EMAIL_FROM,
+                    to_addr=EMAIL_TO,
+                    workers=GEN_WORKERS,
+                    cache=generate_report.EinsteinCache(CACHE_DIR),
+                    timer=run_timer,
+                    on_result=on_generated,
+                    attach_excel=True,
+                    image_profile=IMAGE_PROFILE,
+                    max_mail_kb=MAX_MAIL_KB,
+                )
         except Exception as e:
-            print(f'  ERREUR generation {os.path.basename(excel_path)}: {e}')
-
-    print(f'\n{len(eml_files)} rapports generes sur {len(excels)} Excel')
-
-    if not eml_files:
-        raise SystemExit('0 rapport genere')
-
-    # Phase 2 : envoi par lots
-    total_sent = 0
-    total_errors = 0
-
-    for i in range(0, len(eml_files), BATCH_SIZE):
-        batch = eml_files[i:i + BATCH_SIZE]
-        print(f'--- Lot {i // BATCH_SIZE + 1} ---')
-
-        s = smtp_connect()
-        for eml_path, xlsx_path in batch:
-            try:
-                send_eml(s, eml_path, xlsx_path)
-                total_sent += 1
-                print(f'  Envoye : {os.path.basename(eml_path)} -> {EMAIL_TO}')
-            except Exception as e:
-                total_errors += 1
-                print(f'  ERREUR envoi {os.path.basename(eml_path)}: {e}')
-        s.quit()
-
-        if i + BATCH_SIZE < len(eml_files):
-            print(f'  Pause {DELAY_SECONDS}s...')
-            time.sleep(DELAY_SECONDS)
-
-    print(f'\nTermine ! {total_sent} mails envoyes')
-    if total_sent == 0:
+            generation['error'] = e
+        finally:
+            ready.put(None)
+
+    def on_sent(job, error):
+        eml_path, xlsx_path, _ = job
+        if error:
+            print(f'  ERREUR envoi {os.path.basename(eml_path)}: {error}')
+            manifest.update(xlsx_path.name, status='send_failed', error=error)
+        else:
+            print(f'  Envoye : {os.path.basename(eml_path)} -> {EMAIL_TO}')
+            manifest.update(xlsx_path.name, status='sent', message_id=message_id(eml_path), error=None)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    send_t0 = time.perf_counter()
+    send_all(
+        ready,
+        lambda job: (EMAIL_FROM, [EMAIL_TO], build_eml(*job)),
+        connections=SMTP_CONNECTIONS,
+        on_done=on_sent,
+    )
+    producer.join()
+
+    if 'error' in generation:
+        raise SystemExit(f"Generation impossible: {generation['error']}")
+    results = generation['results']
+    total_sent = manifest.count('sent', names) - already_sent
+    total_errors = manifest.count('send_failed', names)
+    print(f"\n{len(results) - sum(1 for r in results if r['error'])} rapports generes sur {len(to_generate)} a generer")
+
+    summary = summarize_run(results, run_timer, time.perf_counter() - send_t0)
+    summary['sent'] = total_sent
+    with open(os.path.join(DOWNLOAD_DIR, 'run_summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f'\nTermine ! {total_sent} mails envoyes' + (f' ({already_sent} deja envoyes avant reprise)' if already_sent else ''))
+    if total_sent + already_sent == 0:
         raise SystemExit('0 mails envoyes')
     if total_errors > 0:
         print(f'ATTENTION: {total_errors} erreurs.')